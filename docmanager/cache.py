@@ -0,0 +1,430 @@
+"""
+Cache backends shared by the gunicorn workers of one host.
+
+SQLiteCache is the shared (L2) store: a single SQLite file in WAL mode that
+every worker process opens. TieredCache puts a bounded in-process LRU (L1) in
+front of it and adds single-flight get_or_set():
+
+    CACHES = {
+        'shared': {'BACKEND': 'docmanager.cache.SQLiteCache', 'LOCATION': BASE_DIR / 'cache.sqlite3'},
+        'exports': {'BACKEND': 'docmanager.cache.TieredCache', 'LOCATION': 'shared', 'KEY_PREFIX': 'exports'},
+    }
+
+Cross-worker invalidation works through two counters kept in L2. clear()
+bumps the generation, which is part of every key, so all old entries become
+unreachable at once. delete() and incr() bump the invalidation counter and log
+the affected keys under the new sequence number; workers check the counters at
+most every SYNC_INTERVAL seconds and evict just the logged keys from their L1,
+so frequent per-key deletes don't cost the other workers their whole L1. Only
+a gap in the log (an entry culled, or not written yet) drops the whole L1.
+set() is not broadcast: values that change under the same key should carry a
+version (in the key or the value) or be delete()d.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SQLITE_BATCH_SIZE = 500
+CULL_EVERY = 100
+FLIGHT_LOCKS = 64
+LOCK_POLL_INTERVAL = 0.05
+# a worker further behind than this many deletes drops its whole L1 instead of replaying the log
+INVALIDATION_LOG_MAX = 1000
+
+_MISSING = object()
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = str(location)
+        self.connection = None
+        self.pid = None
+        self.writes = 0
+
+    def connect(self):
+        # Django keeps one backend instance per thread; forked workers reconnect
+        if self.connection is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=20, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS cache_expires_idx ON cache (expires)')
+            self.pid = os.getpid()
+        return self.connection
+
+    def dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self.connect().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)', (key, time.time()),
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        found = {}
+        names = list(keys)
+        now = time.time()
+        for start in range(0, len(names), SQLITE_BATCH_SIZE):
+            batch = names[start:start + SQLITE_BATCH_SIZE]
+            rows = self.connect().execute(
+                'SELECT key, value FROM cache WHERE key IN (%s) AND (expires IS NULL OR expires > ?)'
+                % ', '.join('?' * len(batch)),
+                (*batch, now),
+            )
+            for name, value in rows:
+                found[keys[name]] = pickle.loads(value)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [(self.make_and_validate_key(key, version=version), self.dumps(value), expires)
+                for key, value in data.items()]
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', rows)
+        self.maybe_cull(len(rows))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        # inserts, or replaces an expired row; atomic, so usable as a lock
+        cursor = self.connect().execute(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, self.dumps(value), self.get_backend_timeout(timeout), time.time()),
+        )
+        self.maybe_cull(1)
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self.connect().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self.connect()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)', (key, time.time()),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?', (self.dumps(value), key))
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version) > 0
+
+    def delete_many(self, keys, version=None):
+        names = [self.make_and_validate_key(key, version=version) for key in keys]
+        deleted = 0
+        for start in range(0, len(names), SQLITE_BATCH_SIZE):
+            batch = names[start:start + SQLITE_BATCH_SIZE]
+            cursor = self.connect().execute(
+                'DELETE FROM cache WHERE key IN (%s)' % ', '.join('?' * len(batch)), batch,
+            )
+            deleted += cursor.rowcount
+        return deleted
+
+    def clear(self):
+        self.connect().execute('DELETE FROM cache')
+
+    def maybe_cull(self, writes):
+        self.writes += writes
+        if self.writes < CULL_EVERY:
+            return
+        self.writes = 0
+        connection = self.connect()
+        connection.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            # entries closest to expiry go first, entries without a timeout last
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,),
+            )
+
+    def close(self, **kwargs):
+        # the connection is reused across requests, like LocMem's dict
+        pass
+
+
+class LRU:
+    # values are stored pickled so callers can't mutate what other readers get back
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+        return pickle.loads(entry[0])
+
+    def set(self, key, value, timeout):
+        entry = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.monotonic() + timeout)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TierState:
+    # per-process state of one TieredCache, shared by the per-thread backend instances
+    def __init__(self, max_entries):
+        self.l1 = LRU(max_entries)
+        self.lock = threading.Lock()
+        self.flight_locks = [threading.Lock() for _ in range(FLIGHT_LOCKS)]
+        self.generation = None
+        self.invalidations = None
+        self.synced_at = 0.0
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = location
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+        self.sync_interval = options.get('SYNC_INTERVAL', 1.0)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 30)
+
+        name = f'{location}:{self.key_prefix}'
+        with _states_lock:
+            if name not in _states:
+                _states[name] = TierState(options.get('L1_MAX_ENTRIES', 1000))
+            self.state = _states[name]
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def counter_key(self, name):
+        return f'{self.key_prefix}:tier:{name}'
+
+    def read_counter(self, name):
+        key = self.counter_key(name)
+        value = self.l2.get(key)
+        if value is None:
+            # a lost counter restarts from the clock, never from an earlier value
+            self.l2.add(key, time.time_ns(), timeout=None)
+            value = self.l2.get(key)
+        return value
+
+    def bump_counter(self, name):
+        self.read_counter(name)
+        try:
+            return self.l2.incr(self.counter_key(name))
+        except ValueError:
+            return None
+
+    def log_key(self, sequence):
+        return self.counter_key(f'invalidated:{sequence}')
+
+    def invalidate(self, names):
+        sequence = self.bump_counter('invalidations')
+        if sequence is not None:
+            # kept well past the L1 lifetime of anything the keys could name
+            self.l2.set(self.log_key(sequence), names, timeout=max(self.l1_timeout, self.sync_interval) * 10)
+
+    def evict_invalidated(self, seen, current):
+        l1 = self.state.l1
+        if seen is None or not 0 < current - seen <= INVALIDATION_LOG_MAX:
+            l1.clear()
+            return
+        logged = self.l2.get_many([self.log_key(sequence) for sequence in range(seen + 1, current + 1)])
+        if len(logged) != current - seen:
+            l1.clear()
+            return
+        for names in logged.values():
+            for name in names:
+                l1.delete(name)
+
+    def sync(self, force=False):
+        state = self.state
+        now = time.monotonic()
+        if not force and now - state.synced_at < self.sync_interval:
+            return state.generation
+        with state.lock:
+            generation = self.read_counter('generation')
+            invalidations = self.read_counter('invalidations')
+            if generation != state.generation:
+                state.l1.clear()
+            elif invalidations != state.invalidations:
+                self.evict_invalidated(state.invalidations, invalidations)
+            state.generation, state.invalidations = generation, invalidations
+            state.synced_at = now
+        return state.generation
+
+    def tier_key(self, key, version=None):
+        return f'{self.make_and_validate_key(key, version=version)}:g{self.sync()}'
+
+    def l1_ttl(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.tier_key(key, version)
+        value = self.state.l1.get(key)
+        if value is _MISSING:
+            value = self.l2.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self.state.l1.set(key, value, self.l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = {}
+        for key in keys:
+            name = self.tier_key(key, version)
+            value = self.state.l1.get(name)
+            if value is _MISSING:
+                remote[name] = key
+            else:
+                found[key] = value
+        if remote:
+            for name, value in self.l2.get_many(remote).items():
+                self.state.l1.set(name, value, self.l1_timeout)
+                found[remote[name]] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        names = {self.tier_key(key, version): value for key, value in data.items()}
+        self.l2.set_many(names, timeout)
+        ttl = self.l1_ttl(timeout)
+        for name, value in names.items():
+            if ttl > 0:
+                self.state.l1.set(name, value, ttl)
+            else:
+                self.state.l1.delete(name)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        name = self.tier_key(key, version)
+        if not self.l2.add(name, value, timeout):
+            return False
+        self.state.l1.set(name, value, self.l1_ttl(timeout))
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(self.tier_key(key, version), timeout)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version) is not _MISSING
+
+    def incr(self, key, delta=1, version=None):
+        name = self.tier_key(key, version)
+        value = self.l2.incr(name, delta)
+        self.state.l1.delete(name)
+        self.invalidate([name])
+        return value
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version) > 0
+
+    def delete_many(self, keys, version=None):
+        names = [self.tier_key(key, version) for key in keys]
+        if not names:
+            return 0
+        for name in names:
+            self.state.l1.delete(name)
+        deleted = self.l2.delete_many(names)
+        self.invalidate(names)
+        return deleted or 0
+
+    def clear(self):
+        # old-generation entries stay in L2 until they expire or get culled
+        self.bump_counter('generation')
+        self.state.l1.clear()
+        self.sync(force=True)
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Single-flight: on a miss only one caller computes the value. Threads of
+        this process queue on a local lock, other processes on a lock entry in
+        L2 (held at most LOCK_TIMEOUT seconds) and pick the value up once set.
+        """
+        value = self.get(key, _MISSING, version)
+        if value is not _MISSING:
+            return value
+
+        name = self.tier_key(key, version)
+        with self.state.flight_locks[hash(name) % FLIGHT_LOCKS]:
+            value = self.get(key, _MISSING, version)
+            if value is not _MISSING:
+                return value
+
+            lock_key = f'{name}:lock'
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout
+            while not self.l2.add(lock_key, token, self.lock_timeout):
+                time.sleep(LOCK_POLL_INTERVAL)
+                value = self.get(key, _MISSING, version)
+                if value is not _MISSING:
+                    return value
+                if time.monotonic() > deadline:
+                    # the holder is gone or too slow, compute without the lock
+                    token = None
+                    break
+
+            try:
+                value = default() if callable(default) else default
+                self.set(key, value, timeout, version)
+            finally:
+                if token is not None and self.l2.get(lock_key) == token:
+                    self.l2.delete(lock_key)
+            return value
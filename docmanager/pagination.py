@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+# keyset pagination: pages are filtered on the ordering key, never counted or offset
+class KeysetPagination(CursorPagination):
+    ordering = ('-id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class DocumentPagination(KeysetPagination):
+    ordering = ('-updated_at', '-id')
+
+
+class NotificationPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'documents',
     'notifications',
     'exports',
+    'search',
     'drf_spectacular',
 ]
 
@@ -50,6 +51,10 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # ?format= selects the export format, not the DRF renderer
+    'URL_FORMAT_OVERRIDE': None,
+    'DEFAULT_PAGINATION_CLASS': 'docmanager.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 MIDDLEWARE = [
@@ -90,10 +95,96 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets background workers stream long reads while others write
+            'init_command': 'PRAGMA journal_mode=WAL;',
+            'timeout': 20,
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# 'shared' is one SQLite file used by every worker on the host; the other
+# aliases put a per-process LRU in front of it, see docmanager/cache.py
+CACHES = {
+    'shared': {
+        'BACKEND': 'docmanager.cache.SQLiteCache',
+        'LOCATION': BASE_DIR / 'cache.sqlite3',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+    'default': {
+        'BACKEND': 'docmanager.cache.TieredCache',
+        'LOCATION': 'shared',
+        'KEY_PREFIX': 'default',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 30,
+        },
+    },
+    'exports': {
+        'BACKEND': 'docmanager.cache.TieredCache',
+        'LOCATION': 'shared',
+        'KEY_PREFIX': 'exports',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            # rendered exports are large, keep few of them per process
+            'L1_MAX_ENTRIES': 50,
+        },
+    },
+    # serialized documents, see documents/cache.py
+    'representations': {
+        'BACKEND': 'docmanager.cache.TieredCache',
+        'LOCATION': 'shared',
+        'KEY_PREFIX': 'representations',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# test runs get their own cache file and file roots, see docmanager/test_runner.py
+TEST_RUNNER = 'docmanager.test_runner.DocManagerTestRunner'
+
+# Rendered exports larger than this (in characters) are not cached
+EXPORT_CACHE_MAX_SIZE = 1024 * 1024
+
+# Background export jobs, see `manage.py run_export_worker`
+EXPORT_JOBS_ROOT = BASE_DIR / 'export_jobs'
+EXPORT_JOBS_TTL = 24 * 60 * 60
+EXPORT_JOBS_WORKERS = 4
+EXPORT_JOBS_PER_USER = 2
+# running jobs without a heartbeat for this many seconds are requeued (their worker died)
+EXPORT_JOBS_STALE_AFTER = 10 * 60
+
+# Document imports, see `manage.py import_documents`
+IMPORT_JOBS_ROOT = BASE_DIR / 'import_jobs'
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_WORKERS = 4
+# running jobs without a checkpoint for this many seconds are taken over by --pending (their process died)
+IMPORT_JOBS_STALE_AFTER = 10 * 60
+
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = 'media/'
+
+# Chunked attachment uploads, see documents/uploads.py
+UPLOAD_SESSIONS_ROOT = BASE_DIR / 'uploads'
+UPLOAD_CHUNK_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# Attachment downloads: None streams from Python, 'x-sendfile' (Apache, lighttpd)
+# or 'x-accel-redirect' (nginx) leave the bytes to the front proxy. With nginx,
+# ATTACHMENT_SENDFILE_PREFIX is an `internal` location aliased to MEDIA_ROOT.
+ATTACHMENT_SENDFILE = None
+ATTACHMENT_SENDFILE_PREFIX = '/protected-media/'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,34 @@
+import copy
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class DocManagerTestRunner(DiscoverRunner):
+    """
+    Points the shared SQLite cache and the file roots at a temporary directory,
+    so test runs neither touch the working copy nor share state with each other
+    or with a running dev server.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.scratch = tempfile.TemporaryDirectory(prefix='docmanager-tests-')
+        caches = copy.deepcopy(settings.CACHES)
+        caches['shared']['LOCATION'] = os.path.join(self.scratch.name, 'cache.sqlite3')
+        self.scratch_settings = override_settings(
+            CACHES=caches,
+            MEDIA_ROOT=os.path.join(self.scratch.name, 'media'),
+            UPLOAD_SESSIONS_ROOT=os.path.join(self.scratch.name, 'uploads'),
+            EXPORT_JOBS_ROOT=os.path.join(self.scratch.name, 'export_jobs'),
+            IMPORT_JOBS_ROOT=os.path.join(self.scratch.name, 'import_jobs'),
+        )
+        self.scratch_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.scratch_settings.disable()
+        self.scratch.cleanup()
+        super().teardown_test_environment(**kwargs)
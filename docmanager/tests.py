@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from .cache import SQLiteCache, TierState, TieredCache
+
+
+class CacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings_override = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'l2': {'BACKEND': 'docmanager.cache.SQLiteCache', 'LOCATION': os.path.join(self.root.name, 'cache.sqlite3')},
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def tiered(self, prefix='tiered'):
+        # a separate TierState stands in for another worker process
+        cache = TieredCache('l2', {'KEY_PREFIX': prefix, 'OPTIONS': {'SYNC_INTERVAL': 0}})
+        cache.state = TierState(100)
+        return cache
+
+
+class SQLiteCacheTests(CacheTestCase):
+    def test_basic_operations(self):
+        cache = SQLiteCache(os.path.join(self.root.name, 'cache.sqlite3'), {})
+        cache.set('a', {'value': 1})
+        cache.set_many({'b': 2, 'c': 3})
+        self.assertEqual(cache.get('a'), {'value': 1})
+        self.assertEqual(cache.get_many(['a', 'b', 'missing']), {'a': {'value': 1}, 'b': 2})
+        self.assertEqual(cache.incr('b', 5), 7)
+
+        self.assertFalse(cache.add('c', 4))
+        self.assertTrue(cache.delete('c'))
+        self.assertTrue(cache.add('c', 4))
+        self.assertEqual(cache.get('c'), 4)
+
+    def test_expired_entries_are_misses_and_can_be_added(self):
+        cache = SQLiteCache(os.path.join(self.root.name, 'cache.sqlite3'), {})
+        cache.set('a', 1, timeout=0)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.add('a', 2))
+        self.assertEqual(cache.get('a'), 2)
+
+
+class TieredCacheTests(CacheTestCase):
+    def test_l1_serves_hits_without_l2(self):
+        cache = self.tiered()
+        cache.set('key', [1, 2])
+        cache.l2.delete(cache.tier_key('key'))
+        self.assertEqual(cache.get('key'), [1, 2])
+
+        # values come back as copies
+        cache.get('key').append(3)
+        self.assertEqual(cache.get('key'), [1, 2])
+
+    def test_delete_and_clear_reach_other_workers(self):
+        worker, other = self.tiered(), self.tiered()
+        worker.set('key', 'old')
+        self.assertEqual(other.get('key'), 'old')
+
+        worker.delete('key')
+        self.assertIsNone(other.get('key'))
+
+        worker.set_many({'a': 1, 'b': 2})
+        self.assertEqual(other.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        worker.clear()
+        self.assertEqual(other.get_many(['a', 'b']), {})
+
+    def test_delete_evicts_only_that_key_from_other_workers(self):
+        worker, other = self.tiered(), self.tiered()
+        worker.set_many({'a': 1, 'b': 2})
+        self.assertEqual(other.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        # without its L2 row, 'b' can only come from the other worker's L1
+        other.l2.delete(other.tier_key('b'))
+
+        for _ in range(3):
+            worker.delete('a')
+        self.assertIsNone(other.get('a'))
+        self.assertEqual(other.get('b'), 2)
+
+    def test_gap_in_the_invalidation_log_drops_the_whole_l1(self):
+        worker, other = self.tiered(), self.tiered()
+        worker.set_many({'a': 1, 'b': 2})
+        self.assertEqual(other.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        other.l2.delete(other.tier_key('b'))
+
+        worker.delete('a')
+        worker.l2.delete(worker.log_key(worker.read_counter('invalidations')))
+        self.assertIsNone(other.get('b'))
+
+    def test_get_or_set_is_single_flight(self):
+        caches = [self.tiered() for _ in range(4)]
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda cache=cache: results.append(cache.get_or_set('key', compute)))
+                   for cache in caches for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
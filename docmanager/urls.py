@@ -18,7 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import SpectacularSwaggerView, SpectacularAPIView, SpectacularRedocView
 from rest_framework.routers import DefaultRouter
-from documents.views import DocumentTypeViewSet, ContractViewSet, ReportViewSet, NoteViewSet
+from documents.views import DocumentTypeViewSet, ContractViewSet, ReportViewSet, NoteViewSet, UploadViewSet, AttachmentViewSet, ImportJobViewSet
 from notifications.views import NotificationViewSet
 from django.conf import settings
 from django.conf.urls.static import static
@@ -28,12 +28,16 @@ router.register(r'document-types', DocumentTypeViewSet)
 router.register(r'contracts', ContractViewSet)
 router.register(r'reports', ReportViewSet)
 router.register(r'notes', NoteViewSet)
+router.register(r'uploads', UploadViewSet, basename='upload')
+router.register(r'attachments', AttachmentViewSet, basename='attachment')
+router.register(r'imports', ImportJobViewSet, basename='import')
 router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/exports/', include('exports.urls')),
+    path('api/search/', include('search.urls')),
     path('api-auth/', include('rest_framework.urls')),
     path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
     path('', SpectacularSwaggerView.as_view(url_name='api-schema'), name='swagger-ui'),
@@ -0,0 +1,238 @@
+import math
+import threading
+
+import numpy as np
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import get_list_watermark
+from .models import Report, ReportSection
+
+LOAD_CHUNK_SIZE = 500
+DEFAULT_PERCENTILES = (50, 90)
+GROUP_FIELDS = ('department', 'month')
+
+
+def extract_values(name, data):
+    # numbers become one value of metric <section>; dicts nest as <section>.<key>,
+    # lists of numbers contribute one value per item; NaN and infinities are skipped
+    if isinstance(data, bool):
+        return
+    if isinstance(data, (int, float)):
+        if math.isfinite(data):
+            yield name, float(data)
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            yield from extract_values(f'{name}.{key}', value)
+    elif isinstance(data, list):
+        for value in data:
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                yield name, float(value)
+
+
+class ReportValueStore:
+    """
+    In-process column store of numeric section values.
+
+    Each report's values are kept separately with the updated_at they were
+    read at; refresh() reloads only reports whose updated_at moved (or that
+    were invalidated by a save in this process) and drops deleted ones, then
+    concatenates everything into flat arrays for the aggregations. The
+    (id, updated_at) scan only runs once the reports table watermark (see
+    documents/cache.py) has moved since the last one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reports = {}
+        self.signatures = {}
+        self.dirty = set()
+        self.departments = {}
+        self.metrics = {}
+        self.columns = None
+        self.watermark = None
+
+    def invalidate(self, report_ids):
+        with self.lock:
+            self.dirty.update(report_ids)
+
+    def clear(self):
+        with self.lock:
+            self.reports.clear()
+            self.signatures.clear()
+            self.dirty.clear()
+            self.columns = None
+            self.watermark = None
+
+    def intern(self, table, value):
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def refresh(self):
+        with self.lock:
+            # read before the scan, so a write committed during it moves the watermark again
+            watermark = get_list_watermark(Report)
+            if watermark != self.watermark or self.dirty:
+                current = dict(Report.objects.values_list('id', 'updated_at').order_by())
+                stale = {pk for pk, updated_at in current.items() if self.signatures.get(pk) != updated_at}
+                stale |= self.dirty & current.keys()
+                removed = self.signatures.keys() - current.keys()
+
+                if stale or removed:
+                    for pk in removed:
+                        self.reports.pop(pk, None)
+                        self.signatures.pop(pk, None)
+                    self.load(sorted(stale), current)
+                    self.columns = None
+                self.dirty.clear()
+                self.watermark = watermark
+
+            if self.columns is None:
+                self.columns = self.concatenate()
+            return self.columns
+
+    def load(self, report_ids, signatures):
+        for start in range(0, len(report_ids), LOAD_CHUNK_SIZE):
+            chunk = report_ids[start:start + LOAD_CHUNK_SIZE]
+            values = {pk: ([], []) for pk in chunk}
+            headers = {}
+            sections = ReportSection.objects.filter(report_id__in=chunk).values_list(
+                'report_id', 'name', 'report_date', 'department', 'data',
+            ).order_by()
+            for report_id, name, report_date, department, data in sections:
+                headers[report_id] = (report_date, department)
+                metrics, numbers = values[report_id]
+                for metric, number in extract_values(name, data):
+                    metrics.append(self.intern(self.metrics, metric))
+                    numbers.append(number)
+
+            for pk in chunk:
+                metrics, numbers = values[pk]
+                if metrics:
+                    report_date, department = headers[pk]
+                    self.reports[pk] = (
+                        np.datetime64(report_date, 'D'),
+                        self.intern(self.departments, department),
+                        np.array(metrics, dtype=np.int32),
+                        np.array(numbers, dtype=np.float64),
+                    )
+                else:
+                    self.reports.pop(pk, None)
+                self.signatures[pk] = signatures[pk]
+
+    def concatenate(self):
+        # name tables are copied so readers never see them grow mid-aggregation
+        columns = {'departments': list(self.departments), 'metrics': list(self.metrics)}
+        rows = list(self.reports.values())
+        if not rows:
+            columns.update({
+                'date': np.array([], dtype='datetime64[D]'),
+                'department': np.array([], dtype=np.int32),
+                'metric': np.array([], dtype=np.int32),
+                'value': np.array([], dtype=np.float64),
+            })
+            return columns
+        lengths = np.fromiter((len(row[3]) for row in rows), dtype=np.int64, count=len(rows))
+        columns.update({
+            'date': np.repeat(np.array([row[0] for row in rows], dtype='datetime64[D]'), lengths),
+            'department': np.repeat(np.array([row[1] for row in rows], dtype=np.int32), lengths),
+            'metric': np.concatenate([row[2] for row in rows]),
+            'value': np.concatenate([row[3] for row in rows]),
+        })
+        return columns
+
+
+store = ReportValueStore()
+
+
+# saves that skip updated_at would otherwise go unnoticed by refresh() in this process
+@receiver(post_save, sender=Report)
+@receiver(post_delete, sender=Report)
+def invalidate_report_values(sender, instance, **kwargs):
+    store.invalidate([instance.pk])
+
+
+def month_codes(dates):
+    return dates.astype('datetime64[M]').astype(np.int64)
+
+
+def month_label(code):
+    return f'{1970 + code // 12:04d}-{code % 12 + 1:02d}'
+
+
+def percentiles_sorted(values, starts, counts, percentile):
+    # linear interpolation (numpy's default method) on values already sorted within each group
+    position = (counts - 1) * (percentile / 100.0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    fraction = position - lower
+    low = values[starts + lower]
+    return low + (values[starts + upper] - low) * fraction
+
+
+def aggregate(columns, group_by=GROUP_FIELDS, percentiles=DEFAULT_PERCENTILES,
+              departments=None, metrics=None, date_after=None, date_before=None):
+    mask = np.ones(len(columns['value']), dtype=bool)
+    if date_after is not None:
+        mask &= columns['date'] >= np.datetime64(date_after, 'D')
+    if date_before is not None:
+        mask &= columns['date'] <= np.datetime64(date_before, 'D')
+    if departments:
+        codes = [code for code, name in enumerate(columns['departments']) if name in departments]
+        mask &= np.isin(columns['department'], codes)
+    if metrics:
+        # a section name selects all of its nested metrics too
+        codes = [code for code, name in enumerate(columns['metrics'])
+                 if name in metrics or name.split('.', 1)[0] in metrics]
+        mask &= np.isin(columns['metric'], codes)
+
+    values = columns['value'][mask]
+    if not len(values):
+        return []
+    components = [('metric', columns['metric'][mask])]
+    if 'department' in group_by:
+        components.append(('department', columns['department'][mask]))
+    if 'month' in group_by:
+        components.append(('month', month_codes(columns['date'][mask])))
+
+    # pack the group columns into one int64 key (mixed radix), so a single
+    # sort by (key, value) yields the groups and the per-group order statistics
+    offsets = [component.min() for _, component in components]
+    shape = [int(component.max() - offset) + 1 for (_, component), offset in zip(components, offsets)]
+    keys = np.ravel_multi_index([component - offset for (_, component), offset in zip(components, offsets)], shape)
+
+    order = np.lexsort((values, keys))
+    sorted_keys = keys[order]
+    sorted_values = values[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_keys)) + 1))
+    counts = np.diff(np.append(starts, len(sorted_values)))
+    sums = np.add.reduceat(sorted_values, starts)
+
+    stats = {
+        'count': counts,
+        'sum': sums,
+        'mean': sums / counts,
+        'min': sorted_values[starts],
+        'max': sorted_values[starts + counts - 1],
+    }
+    for percentile in percentiles:
+        stats[f'p{percentile:g}'] = percentiles_sorted(sorted_values, starts, counts, percentile)
+
+    labels = {
+        'metric': columns['metrics'].__getitem__,
+        'department': columns['departments'].__getitem__,
+        'month': month_label,
+    }
+    group_columns = {
+        name: [labels[name](code) for code in (codes + offset).tolist()]
+        for (name, _), codes, offset in zip(components, np.unravel_index(sorted_keys[starts], shape), offsets)
+    }
+    group_columns.update((name, stat.tolist()) for name, stat in stats.items())
+    names = list(group_columns)
+    return [dict(zip(names, row)) for row in zip(*group_columns.values())]
+
+
+def report_analytics(**options):
+    return aggregate(store.refresh(), **options)
@@ -23,7 +23,7 @@ class DocumentBuilder(ABC):
 class ContractBuilder(DocumentBuilder):
     def __init__(self):
         self.contract = Contract()
-        self.contract.terms_conditions = ""
+        self.terms_sections = []
 
     def set_title(self, title):
         self.contract.title = title
@@ -51,11 +51,12 @@ class ContractBuilder(DocumentBuilder):
         return self
 
     def add_terms_section(self, section_title, section_content):
-        section = f"\n## {section_title}\n\n{section_content}"
-        self.contract.terms_conditions += section
+        self.terms_sections.append((section_title, section_content))
         return self
 
     def get_result(self):
+        # joined once here; the ContractSection rows are created when the contract is saved
+        self.contract.terms_conditions = Contract.join_terms(self.terms_sections)
         return self.contract
 
 
@@ -132,6 +133,24 @@ class DocumentDirector:
             .add_terms_section("Payment Terms", "Payment shall be made within 30 days.") \
             .get_result()
 
+    def make_contract(self, title, author, document_type, party_name, start_date, end_date, value, terms_sections):
+        contract_builder = self.builder
+        if not isinstance(contract_builder, ContractBuilder):
+            raise ValueError("Builder must be a ContractBuilder")
+
+        contract_builder \
+            .set_title(title) \
+            .set_author(author) \
+            .set_document_type(document_type) \
+            .set_party_name(party_name) \
+            .set_date_range(start_date, end_date) \
+            .set_value(value)
+
+        for section_title, section_content in terms_sections:
+            contract_builder.add_terms_section(section_title, section_content)
+
+        return contract_builder.get_result()
+
     def make_comprehensive_report(self, title, author, document_type, date, department, summary, data_sections):
         report_builder = self.builder
         if not isinstance(report_builder, ReportBuilder):
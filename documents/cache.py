@@ -0,0 +1,56 @@
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+REPRESENTATION_CACHE_ALIAS = 'representations'
+LIST_WATERMARK_CACHE_ALIAS = 'default'
+
+
+def representation_key(model, pk):
+    return f"representation_{model._meta.label_lower}_{pk}"
+
+
+def representation_stamp(instance, request=None):
+    # file URLs are absolute when a request is around, so the host is part of the stamp
+    base_uri = request.build_absolute_uri('/') if request is not None else ''
+    return instance.version, instance.updated_at.timestamp(), base_uri
+
+
+def get_representations(instances, request=None):
+    # one get_many for the whole page; entries whose stamp is outdated count as misses
+    keys = {instance.pk: representation_key(type(instance), instance.pk) for instance in instances}
+    cached = caches[REPRESENTATION_CACHE_ALIAS].get_many(keys.values())
+    found = {}
+    for instance in instances:
+        entry = cached.get(keys[instance.pk])
+        if entry is not None and entry[0] == representation_stamp(instance, request):
+            found[instance.pk] = entry[1]
+    return found
+
+
+def set_representations(instances, representations, request=None):
+    caches[REPRESENTATION_CACHE_ALIAS].set_many({
+        representation_key(type(instance), instance.pk): (representation_stamp(instance, request), data)
+        for instance, data in zip(instances, representations)
+    })
+
+
+def invalidate_representation(model, pk):
+    caches[REPRESENTATION_CACHE_ALIAS].delete(representation_key(model, pk))
+
+
+def list_watermark_key(model):
+    return f"list_watermark_{model._meta.label_lower}"
+
+
+def get_list_watermark(model):
+    # time of the first read after the table's last write; no query, writers just drop the key
+    return caches[LIST_WATERMARK_CACHE_ALIAS].get_or_set(list_watermark_key(model), time.time, timeout=None)
+
+
+def touch_list_watermark(model):
+    # again after commit, so a read between the write and the commit can't pin the old rows to a new watermark
+    cache, key = caches[LIST_WATERMARK_CACHE_ALIAS], list_watermark_key(model)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
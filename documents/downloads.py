@@ -0,0 +1,133 @@
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class FileRange:
+    # file-like view of [start, start + length) that FileResponse can stream
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    # only single ranges are served partially, anything else gets the whole file
+    match = RANGE_RE.fullmatch(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        # an empty file has no last bytes to send either
+        if not length or not size:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def attachment_etag(attachment):
+    if attachment.checksum:
+        return f'"{attachment.checksum}"'
+    return f'"{attachment.pk}-{int(attachment.uploaded_at.timestamp())}"'
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def sendfile_response(attachment):
+    response = HttpResponse()
+    if settings.ATTACHMENT_SENDFILE == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = quote(settings.ATTACHMENT_SENDFILE_PREFIX + attachment.file.name)
+    else:
+        response['X-Sendfile'] = attachment.file.path
+    # let the proxy fill these in from the file it serves
+    del response['Content-Type']
+    return response
+
+
+def serve_attachment(request, attachment):
+    """
+    Serves the attachment's file with conditional GET and single Range support,
+    or hands it to the front proxy when ATTACHMENT_SENDFILE is set.
+    """
+    etag = attachment_etag(attachment)
+    last_modified = int(attachment.uploaded_at.timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    filename = attachment.filename or os.path.basename(attachment.file.name)
+
+    if settings.ATTACHMENT_SENDFILE:
+        response = sendfile_response(attachment)
+    else:
+        size = attachment.size
+        if size is None:
+            size = attachment.file.size
+        source = attachment.file.storage.open(attachment.file.name, 'rb')
+
+        byte_range = None
+        if 'Range' in request.headers and if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_range(request.headers['Range'], size)
+            except RangeNotSatisfiable:
+                source.close()
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        if byte_range:
+            start, end = byte_range
+            response = FileResponse(FileRange(source, start, end - start + 1), status=206,
+                                    content_type=attachment.content_type or None, filename=filename)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            response = FileResponse(source, content_type=attachment.content_type or None, filename=filename)
+            response['Content-Length'] = size
+        response.block_size = DOWNLOAD_BLOCK_SIZE
+        response['Accept-Ranges'] = 'bytes'
+
+    if attachment.content_type:
+        response['Content-Type'] = attachment.content_type
+    response['Content-Disposition'] = content_disposition_header(
+        request.GET.get('inline') is None, filename,
+    )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private'
+    return response
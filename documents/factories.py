@@ -1,11 +1,15 @@
 from abc import ABC, abstractmethod
+from django.db import transaction
 from .models import Contract, Report, Note, Attachment
+from .signals import documents_bulk_created
 
 
 # --------------------------------
 # 1. Factory Method Pattern
 # --------------------------------
 class DocumentCreator(ABC):
+    batch_size = 500
+
     @abstractmethod
     def create_document(self, **kwargs):
         pass
@@ -15,6 +19,21 @@ class DocumentCreator(ABC):
         document.save()
         return document
 
+    # batch mode: one INSERT per batch_size documents, all in one transaction
+    def register_documents(self, documents_data):
+        return self.insert_documents([self.create_document(**kwargs) for kwargs in documents_data])
+
+    # documents built elsewhere (builders, importers) share the same batch insert
+    def insert_documents(self, documents):
+        if not documents:
+            return []
+
+        model = type(documents[0])
+        with transaction.atomic():
+            documents = model.objects.bulk_create(documents, batch_size=self.batch_size)
+            documents_bulk_created.send(sender=model, documents=documents)
+        return documents
+
 
 class ContractCreator(DocumentCreator):
     def create_document(self, **kwargs):
@@ -0,0 +1,347 @@
+import csv
+import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .builders import ContractBuilder, ReportBuilder, DocumentDirector
+from .factories import ContractCreator, ReportCreator
+from .models import DocumentType, ImportJob
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+MAX_STORED_ERRORS = 100
+
+IMPORT_TYPES = {
+    'contract': {
+        'creator': ContractCreator,
+        'required': ('title', 'document_type', 'party_name', 'start_date', 'end_date', 'contract_value'),
+    },
+    'report': {
+        'creator': ReportCreator,
+        'required': ('title', 'document_type', 'report_date', 'department', 'summary'),
+    },
+}
+
+
+class RecordError(ValueError):
+    pass
+
+
+def job_source_path(job):
+    return Path(settings.IMPORT_JOBS_ROOT) / job.source
+
+
+def format_from_name(name):
+    suffix = Path(name).suffix.lower().lstrip('.')
+    return {'jsonl': 'ndjson', 'json': 'ndjson'}.get(suffix, suffix)
+
+
+def save_source(job, chunks):
+    # uploads are streamed to disk chunk by chunk, never held in memory whole
+    job.source = f'{job.pk}.{job.import_format}'
+    path = job_source_path(job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as output:
+        for chunk in chunks:
+            output.write(chunk)
+    job.save(update_fields=['source', 'updated_at'])
+
+
+# --------------------------------
+# Reading: raw records with the byte offset just past each of them
+# --------------------------------
+def iter_lines(source):
+    while True:
+        line = source.readline()
+        if not line:
+            return
+        yield line
+
+
+def read_ndjson(path, offset=0):
+    with open(path, 'rb') as source:
+        source.seek(offset)
+        for line in iter_lines(source):
+            end = source.tell()
+            if line.strip():
+                # a byte order mark can only lead the first line
+                yield line.decode('utf-8-sig' if end == len(line) else 'utf-8'), end
+
+
+def read_csv(path, offset=0):
+    with open(path, 'rb') as source:
+        position = [0]
+
+        def decoded_lines():
+            # csv pulls one line at a time, so after each row `position` is the row's end
+            for line in iter_lines(source):
+                position[0] = source.tell()
+                yield line.decode('utf-8-sig' if position[0] == len(line) else 'utf-8')
+
+        lines = decoded_lines()
+        header = next(csv.reader(lines), None)
+        if header is None:
+            return
+        if offset > position[0]:
+            source.seek(offset)
+        for row in csv.reader(lines):
+            if any(row):
+                yield dict(zip(header, row)), position[0]
+
+
+def read_records(path, import_format, offset=0):
+    return read_csv(path, offset) if import_format == 'csv' else read_ndjson(path, offset)
+
+
+def iter_batches(records, size):
+    batch = []
+    for record, end in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch, end
+            batch = []
+    if batch:
+        yield batch, end
+
+
+# --------------------------------
+# Validation: pure Python, runs in worker processes
+# --------------------------------
+def parse_date(value, field):
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value.strip())
+        except ValueError:
+            pass
+    raise RecordError(f'{field}: expected a YYYY-MM-DD date')
+
+
+def parse_json_field(value, field):
+    # CSV cells carry nested values as JSON text
+    if isinstance(value, str):
+        if not value.strip():
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            raise RecordError(f'{field}: invalid JSON')
+    return value
+
+
+def parse_terms(value):
+    value = parse_json_field(value, 'terms')
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        return [(str(title), str(content)) for title, content in value.items()]
+    if isinstance(value, list):
+        sections = []
+        for item in value:
+            if isinstance(item, dict) and 'title' in item:
+                sections.append((str(item['title']), str(item.get('content', ''))))
+            elif isinstance(item, (list, tuple)) and len(item) == 2:
+                sections.append((str(item[0]), str(item[1])))
+            else:
+                raise RecordError('terms: expected {"title": ..., "content": ...} items')
+        return sections
+    raise RecordError('terms: expected an object or a list of sections')
+
+
+def clean_record(document_type, record):
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError:
+            raise RecordError('invalid JSON')
+    if not isinstance(record, dict):
+        raise RecordError('expected an object')
+
+    missing = [field for field in IMPORT_TYPES[document_type]['required'] if record.get(field) in (None, '')]
+    if missing:
+        raise RecordError(f"missing {', '.join(missing)}")
+
+    title = str(record['title']).strip()[:255]
+    type_ref = record['document_type']
+    cleaned = {
+        'title': title,
+        'document_type': int(type_ref) if str(type_ref).strip().isdigit() else str(type_ref).strip(),
+    }
+
+    if document_type == 'contract':
+        start_date = parse_date(record['start_date'], 'start_date')
+        end_date = parse_date(record['end_date'], 'end_date')
+        if end_date < start_date:
+            raise RecordError('end_date: before start_date')
+        try:
+            value = Decimal(str(record['contract_value']).strip()).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RecordError('contract_value: expected a number')
+        if not value.is_finite() or abs(value) >= Decimal('1e10'):
+            raise RecordError('contract_value: out of range')
+        cleaned.update({
+            'party_name': str(record['party_name']).strip()[:255],
+            'start_date': start_date,
+            'end_date': end_date,
+            'value': value,
+            'terms_sections': parse_terms(record.get('terms')),
+        })
+    else:
+        data_sections = parse_json_field(record.get('data_sections'), 'data_sections') or {}
+        if not isinstance(data_sections, dict):
+            raise RecordError('data_sections: expected an object')
+        cleaned.update({
+            'date': parse_date(record['report_date'], 'report_date'),
+            'department': str(record['department']).strip()[:100],
+            'summary': str(record['summary']),
+            'data_sections': data_sections,
+        })
+    return cleaned
+
+
+def validate_batch(document_type, records):
+    results = []
+    for record in records:
+        try:
+            results.append((clean_record(document_type, record), None))
+        except RecordError as e:
+            results.append((None, str(e)))
+    return results
+
+
+def validate_batches(document_type, batches, workers):
+    if workers <= 1:
+        for records, end in batches:
+            yield records, end, validate_batch(document_type, records)
+        return
+
+    # validation never touches the database, so the forked workers don't need their own connections;
+    # a bounded window of batches keeps reading, validation and inserting overlapped without
+    # pulling the whole file into memory
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        pending = deque()
+        for records, end in batches:
+            pending.append((records, end, pool.submit(validate_batch, document_type, records)))
+            if len(pending) >= workers * 2:
+                records, end, future = pending.popleft()
+                yield records, end, future.result()
+        while pending:
+            records, end, future = pending.popleft()
+            yield records, end, future.result()
+
+
+# --------------------------------
+# Building and inserting
+# --------------------------------
+class DocumentTypeResolver:
+    def __init__(self):
+        self.types = {}
+        for document_type in DocumentType.objects.all():
+            self.types[document_type.pk] = document_type
+            self.types.setdefault(document_type.name, document_type)
+
+    def resolve(self, reference):
+        document_type = self.types.get(reference)
+        if document_type is None:
+            raise RecordError(f'document_type: unknown document type {reference!r}')
+        return document_type
+
+
+def build_document(director, document_type, cleaned, author, resolved_type):
+    # builders accumulate into one instance, so each record gets a fresh one
+    if document_type == 'contract':
+        director.change_builder(ContractBuilder())
+        return director.make_contract(author=author, document_type=resolved_type, **cleaned)
+    director.change_builder(ReportBuilder())
+    return director.make_comprehensive_report(author=author, document_type=resolved_type, **cleaned)
+
+
+def claim_import_job(stale_after=None):
+    """
+    Marks the oldest pending job, or a running one whose process stopped
+    checkpointing (updated_at older than stale_after seconds), as running and
+    returns it; None when there is none. The conditional update lets only one
+    of several concurrent callers win a job.
+    """
+    stale_after = settings.IMPORT_JOBS_STALE_AFTER if stale_after is None else stale_after
+    claimable = ImportJob.objects.filter(
+        Q(status=ImportJob.STATUS_PENDING)
+        | Q(status=ImportJob.STATUS_RUNNING, updated_at__lt=timezone.now() - timedelta(seconds=stale_after)),
+    )
+    while True:
+        job_ids = list(claimable.order_by('created_at', 'id').values_list('id', flat=True)[:10])
+        if not job_ids:
+            return None
+        for job_id in job_ids:
+            if claimable.filter(pk=job_id).update(status=ImportJob.STATUS_RUNNING, updated_at=timezone.now()):
+                return ImportJob.objects.get(pk=job_id)
+
+
+def run_import(job, workers=None, chunk_size=None, progress=None):
+    """
+    Imports job.source from the job's checkpoint on. Every chunk is inserted
+    with bulk_create in the same transaction that advances the checkpoint, so
+    an interrupted import resumes exactly after the last committed chunk.
+    """
+    workers = settings.IMPORT_WORKERS if workers is None else workers
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+
+    creator = IMPORT_TYPES[job.document_type]['creator']()
+    creator.batch_size = chunk_size
+    types = DocumentTypeResolver()
+    director = DocumentDirector(None)
+    author = job.user
+
+    job.status = ImportJob.STATUS_RUNNING
+    job.started_at = job.started_at or timezone.now()
+    job.save(update_fields=['status', 'started_at', 'updated_at'])
+
+    records = read_records(job_source_path(job), job.import_format, job.offset)
+    batches = iter_batches(records, chunk_size)
+    clock = time.monotonic()
+    try:
+        for raw_records, end, results in validate_batches(job.document_type, batches, workers):
+            documents = []
+            errors = []
+            for index, (cleaned, error) in enumerate(results):
+                if error is None:
+                    try:
+                        cleaned['document_type'] = types.resolve(cleaned['document_type'])
+                    except RecordError as e:
+                        error = str(e)
+                if error is not None:
+                    errors.append({'record': job.processed + index + 1, 'error': error})
+                    continue
+                resolved_type = cleaned.pop('document_type')
+                documents.append(build_document(director, job.document_type, cleaned, author, resolved_type))
+
+            now = time.monotonic()
+            job.elapsed += now - clock
+            clock = now
+            job.processed += len(raw_records)
+            job.imported += len(documents)
+            job.failed += len(errors)
+            job.offset = end
+            job.errors = (job.errors + errors)[:MAX_STORED_ERRORS]
+            with transaction.atomic():
+                creator.insert_documents(documents)
+                job.save(update_fields=['processed', 'imported', 'failed', 'offset', 'errors', 'elapsed',
+                                        'updated_at'])
+            if progress:
+                progress(job)
+    except Exception as e:
+        ImportJob.objects.filter(pk=job.pk).update(status=ImportJob.STATUS_FAILED, error=repr(e))
+        raise
+
+    job.status = ImportJob.STATUS_DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return job
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from documents.uploads import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Removes abandoned upload sessions and blobs no attachment refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=24,
+                            help='Only remove sessions and blobs untouched for this long')
+
+    def handle(self, *args, **options):
+        sessions, blobs = collect_garbage(timedelta(hours=options['max_age_hours']))
+        self.stdout.write(f'Removed {sessions} upload sessions and {blobs} blobs')
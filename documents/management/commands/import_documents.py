@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from documents.imports import (
+    IMPORT_FORMATS, IMPORT_TYPES, claim_import_job, format_from_name, run_import, save_source,
+)
+from documents.models import ImportJob
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ('Imports contracts or reports from an NDJSON or CSV file in checkpointed chunks. '
+            'An interrupted import continues with --resume JOB_ID; --pending runs jobs queued through the API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?')
+        parser.add_argument('--type', choices=list(IMPORT_TYPES), help='Document type of the records')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--user', help='Username recorded as the author of the imported documents')
+        parser.add_argument('--resume', type=int, metavar='JOB_ID', help='Continue a job from its checkpoint')
+        parser.add_argument('--pending', action='store_true',
+                            help='Run all pending jobs and running ones that stopped checkpointing')
+        parser.add_argument('--chunk-size', type=int, default=settings.IMPORT_CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=settings.IMPORT_WORKERS,
+                            help='Validation processes, 1 validates inline')
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            # one claim at a time, so jobs still queued behind a long import stay claimable by other processes
+            while (job := claim_import_job()) is not None:
+                self.run(job, options)
+            return
+
+        if options['resume']:
+            try:
+                jobs = [ImportJob.objects.get(pk=options['resume'])]
+            except ImportJob.DoesNotExist:
+                raise CommandError(f"Import job {options['resume']} does not exist")
+            if jobs[0].status == ImportJob.STATUS_DONE:
+                raise CommandError(f'Import job {jobs[0].pk} is already done')
+        else:
+            jobs = [self.create_job(options)]
+
+        for job in jobs:
+            self.run(job, options)
+
+    def create_job(self, options):
+        if not options['file'] or not options['type'] or not options['user']:
+            raise CommandError('A file, --type and --user are required unless --resume or --pending is given')
+        import_format = options['format'] or format_from_name(options['file'])
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError('Could not infer the format from the file name, pass --format')
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        # the job keeps its own copy, so it can resume even if the original moves
+        try:
+            source = open(options['file'], 'rb')
+        except OSError as e:
+            raise CommandError(f"Could not read {options['file']}: {e}")
+        with source, transaction.atomic():
+            job = ImportJob.objects.create(user=user, document_type=options['type'], import_format=import_format)
+            save_source(job, iter(lambda: source.read(COPY_CHUNK_SIZE), b''))
+        return job
+
+    def run(self, job, options):
+        if job.offset:
+            self.stdout.write(f'Resuming import job {job.pk} after record {job.processed}')
+
+        def progress(job):
+            self.stdout.write(f'{job.processed} records, {job.imported} imported, {job.failed} failed, '
+                              f'{job.records_per_second:.0f} records/s')
+
+        run_import(job, workers=options['workers'], chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Import job {job.pk} done: {job.imported} imported, {job.failed} failed in {job.elapsed:.2f}s '
+            f'({job.records_per_second:.0f} records/s)'
+        ))
+        for error in job.errors[:10]:
+            self.stdout.write(f"  record {error['record']}: {error['error']}")
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_sections(apps, schema_editor):
+    Report = apps.get_model('documents', 'Report')
+    ReportSection = apps.get_model('documents', 'ReportSection')
+    sections = []
+    for report in Report.objects.only('id', 'report_date', 'department', 'data').iterator(chunk_size=500):
+        data = report.data.get('sections') if isinstance(report.data, dict) else None
+        for position, section in enumerate(data if isinstance(data, list) else []):
+            if isinstance(section, dict):
+                sections.append(ReportSection(
+                    report_id=report.pk, position=position, name=str(section.get('name', ''))[:255],
+                    report_date=report.report_date, department=report.department, data=section.get('data'),
+                ))
+        if len(sections) >= 500:
+            ReportSection.objects.bulk_create(sections)
+            sections = []
+    ReportSection.objects.bulk_create(sections)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_blob_attachment_checksum_attachment_content_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('report_date', models.DateField()),
+                ('department', models.CharField(max_length=100)),
+                ('data', models.JSONField(blank=True, null=True)),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='documents.report')),
+            ],
+            options={
+                'ordering': ['report', 'position'],
+                'indexes': [models.Index(fields=['name', 'report_date'], name='reportsection_name_date_idx'), models.Index(fields=['department', 'name'], name='reportsection_department_idx'), models.Index(fields=['report_date'], name='reportsection_date_idx')],
+            },
+        ),
+        migrations.RunPython(populate_sections, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:59
+
+import json
+import zlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+# the snapshot format as of this migration, frozen here rather than imported from documents.revisions
+UNTRACKED_FIELDS = {'id', 'unique_id', 'author', 'created_at', 'updated_at'}
+
+
+def document_state(document):
+    state = {}
+    for field in type(document)._meta.concrete_fields:
+        if field.name in UNTRACKED_FIELDS:
+            continue
+        value = getattr(document, field.attname)
+        if isinstance(field, models.JSONField):
+            value = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True, indent=1, ensure_ascii=False)
+        state[field.attname] = json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+    return state
+
+
+def encode_payload(payload):
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 6)
+
+
+def snapshot_existing_documents(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Revision = apps.get_model('documents', 'Revision')
+    for model_name in ('contract', 'report', 'note'):
+        model = apps.get_model('documents', model_name)
+        content_type, _ = ContentType.objects.get_or_create(app_label='documents', model=model_name)
+        revisions = []
+        for document in model.objects.iterator(chunk_size=500):
+            state = document_state(document)
+            revisions.append(Revision(
+                content_type_id=content_type.pk, object_id=document.pk, number=1, version=document.version,
+                is_snapshot=True, payload=encode_payload(state), changed_fields=list(state),
+                author_id=document.author_id,
+            ))
+            if len(revisions) >= 500:
+                Revision.objects.bulk_create(revisions)
+                revisions = []
+        Revision.objects.bulk_create(revisions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('documents', '0005_reportsection'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Revision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('number', models.PositiveIntegerField()),
+                ('version', models.IntegerField()),
+                ('is_snapshot', models.BooleanField(default=False)),
+                ('payload', models.BinaryField()),
+                ('changed_fields', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revisions', to=settings.AUTH_USER_MODEL)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'ordering': ['content_type', 'object_id', 'number'],
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id', 'number'), name='revision_number_unique')],
+            },
+        ),
+        migrations.RunPython(snapshot_existing_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:06
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TERMS_HEADING = re.compile(r'\n## ([^\n]*)\n\n')
+
+
+def populate_sections(apps, schema_editor):
+    Contract = apps.get_model('documents', 'Contract')
+    ContractSection = apps.get_model('documents', 'ContractSection')
+    sections = []
+    for contract in Contract.objects.only('id', 'terms_conditions').iterator(chunk_size=500):
+        parts = TERMS_HEADING.split(contract.terms_conditions or '')
+        terms = [('', parts[0])] if parts[0] else []
+        terms.extend(zip(parts[1::2], parts[2::2]))
+        for position, (title, content) in enumerate(terms):
+            sections.append(ContractSection(contract_id=contract.pk, position=position, title=title[:255],
+                                            content=content))
+        if len(sections) >= 500:
+            ContractSection.objects.bulk_create(sections)
+            sections = []
+    ContractSection.objects.bulk_create(sections)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContractSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('content', models.TextField(blank=True)),
+                ('contract', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms_sections', to='documents.contract')),
+            ],
+            options={
+                'ordering': ['contract', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('contract', 'position'), name='contractsection_position_unique')],
+            },
+        ),
+        migrations.RunPython(populate_sections, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,18 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
-from django.core.cache import cache
+import re
 import uuid
-import copy
+
+from .signals import documents_bulk_created
+
+# terms are stored flattened as "\n## <title>\n\n<content>" per section; text before
+# the first heading is an untitled preamble section
+TERMS_HEADING = re.compile(r'\n## ([^\n]*)\n\n')
+# any "## " line in a section's content could pair with the next section's heading
+TERMS_HEADING_LINE = re.compile(r'^## ', re.MULTILINE)
 
 
 class DocumentMetadata(models.Model):
@@ -37,33 +46,54 @@ class Document(DocumentMetadata):
     document_type = models.ForeignKey(DocumentType, on_delete=models.CASCADE)
     unique_id = models.UUIDField(default=uuid.uuid4, editable=False)
     custom_notes = models.TextField(blank=True, null=True)
+    revisions = GenericRelation('documents.Revision')
 
-    # prototype
+    # prototype: copies concrete field values only, no _state or cached relations
     def clone(self):
-        cache_key = f"document_clone_{self.unique_id}"
-        cached_document = cache.get(cache_key)
-        if cached_document:
-            return cached_document
+        new_document = self.__class__()
+        for field in self._meta.concrete_fields:
+            if not field.primary_key:
+                setattr(new_document, field.attname, getattr(self, field.attname))
 
-        new_document = copy.deepcopy(self)
-        new_document.pk = None
+        now = timezone.now()
         new_document.unique_id = uuid.uuid4()
         new_document.title = f"Copy of {self.title}"
         new_document.status = 'draft'
         new_document.version = self.version + 1
-        new_document.created_at = timezone.now()
-        new_document.updated_at = timezone.now()
-        new_document.custom_notes = self.custom_notes
-
-        cache.set(cache_key, new_document, timeout=3600)
+        new_document.created_at = now
+        new_document.updated_at = now
 
         return new_document
 
+    @classmethod
+    def clone_many(cls, documents, with_attachments=False):
+        documents = list(documents)
+        clones = [document.clone() for document in documents]
+
+        with transaction.atomic():
+            clones = cls.objects.bulk_create(clones)
+            documents_bulk_created.send(sender=cls, documents=clones)
+
+            if with_attachments:
+                related_field = cls.attachments.field.name
+                attachments = [
+                    attachment.clone(**{related_field: cloned})
+                    for original, cloned in zip(documents, clones)
+                    for attachment in original.attachments.all()
+                ]
+                Attachment.objects.bulk_create(attachments)
+                Blob.add_references(attachment.blob_id for attachment in attachments)
+
+        return clones
+
     def __str__(self):
         return self.title
 
     class Meta:
         abstract = True
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='%(class)s_updated_id_idx'),
+        ]
 
 
 class Contract(Document):
@@ -71,8 +101,79 @@ class Contract(Document):
     start_date = models.DateField()
     end_date = models.DateField()
     contract_value = models.DecimalField(max_digits=12, decimal_places=2)
+    # materialized from the ContractSection rows, kept for export, search and full reads
     terms_conditions = models.TextField()
 
+    @staticmethod
+    def split_terms(text):
+        parts = TERMS_HEADING.split(text or '')
+        sections = [('', parts[0])] if parts[0] else []
+        sections.extend(zip(parts[1::2], parts[2::2]))
+        return sections
+
+    @staticmethod
+    def join_terms(sections):
+        return ''.join(
+            content if position == 0 and not title else f"\n## {title}\n\n{content}"
+            for position, (title, content) in enumerate(sections)
+        )
+
+    # rebuilds ContractSection rows from terms_conditions, see documents/signals.py
+    @classmethod
+    def sync_sections(cls, contracts):
+        contracts = [contract for contract in contracts if contract.pk]
+        if not contracts:
+            return
+        sections = [
+            ContractSection(contract=contract, position=position, title=title[:255], content=content)
+            for contract in contracts
+            for position, (title, content) in enumerate(cls.split_terms(contract.terms_conditions))
+        ]
+        with transaction.atomic():
+            ContractSection.objects.filter(contract__in=contracts).delete()
+            ContractSection.objects.bulk_create(sections, batch_size=500)
+
+    def materialize_terms(self, author_id=None):
+        # section rows are already current, so the post_save receivers skip the resync
+        sections = self.terms_sections.order_by('position').values_list('title', 'content')
+        self.terms_conditions = self.join_terms(sections)
+        self._sections_synced = True
+        self._revision_author_id = author_id
+        self.save(update_fields=['terms_conditions', 'updated_at'])
+
+    def first_section_is_preamble(self):
+        return self.terms_sections.filter(position=0, title='').exists()
+
+    def lock(self):
+        # serializes section writes per contract; SQLite has no row locks, there the
+        # unique (contract, position) constraint turns a lost race into an IntegrityError
+        list(Contract.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+
+    def insert_section(self, position, title, content, author_id=None):
+        with transaction.atomic():
+            self.lock()
+            count = self.terms_sections.count()
+            position = count if position is None else min(position, count)
+            if position == 0 and self.first_section_is_preamble():
+                raise ValueError('The untitled preamble must stay the first section')
+            # shifted in two steps through positions past the end, so the unique
+            # (contract, position) constraint holds after every row update
+            later = self.terms_sections.filter(position__gte=position)
+            later.update(position=models.F('position') + count + 1)
+            self.terms_sections.filter(position__gt=count).update(position=models.F('position') - count)
+            section = ContractSection.objects.create(contract=self, position=position, title=title, content=content)
+            self.materialize_terms(author_id)
+        return section
+
+    def update_section(self, section, author_id=None, **changes):
+        with transaction.atomic():
+            self.lock()
+            for name, value in changes.items():
+                setattr(section, name, value)
+            section.save(update_fields=list(changes))
+            self.materialize_terms(author_id)
+        return section
+
 
 class Report(Document):
     report_date = models.DateField()
@@ -80,12 +181,187 @@ class Report(Document):
     summary = models.TextField()
     data = models.JSONField(default=dict)
 
+    # mirrors data['sections'] into ReportSection rows, see documents/signals.py
+    @classmethod
+    def sync_sections(cls, reports):
+        reports = [report for report in reports if report.pk]
+        if not reports:
+            return
+        sections = [
+            ReportSection(report=report, position=position, name=str(section.get('name', ''))[:255],
+                          report_date=report.report_date, department=report.department,
+                          data=section.get('data'))
+            for report in reports
+            for position, section in enumerate(report.get_sections())
+        ]
+        with transaction.atomic():
+            ReportSection.objects.filter(report__in=reports).delete()
+            ReportSection.objects.bulk_create(sections, batch_size=500)
+
+    def get_sections(self):
+        sections = self.data.get('sections') if isinstance(self.data, dict) else None
+        if not isinstance(sections, list):
+            return []
+        return [section for section in sections if isinstance(section, dict)]
+
 
 class Note(Document):
     content = models.TextField()
     priority = models.IntegerField(choices=[(1, 'Low'), (2, 'Medium'), (3, 'High')], default=1)
 
 
+# edit history of a document, see documents/revisions.py
+class Revision(models.Model):
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+
+    number = models.PositiveIntegerField()
+    version = models.IntegerField()
+    # snapshots hold every tracked field, other revisions a delta against the previous one
+    is_snapshot = models.BooleanField(default=False)
+    payload = models.BinaryField()
+    changed_fields = models.JSONField(default=list)
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='revisions')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['content_type', 'object_id', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'number'], name='revision_number_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id} r{self.number}"
+
+
+# streaming NDJSON/CSV import, see documents/imports.py
+class ImportJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    document_type = models.CharField(max_length=20)
+    import_format = models.CharField(max_length=10)
+    source = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=[
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ], default=STATUS_PENDING)
+    # checkpoint: byte offset of the first record not yet committed
+    offset = models.PositiveBigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # seconds spent importing across runs, for the throughput figure
+    elapsed = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='import_job_status_idx'),
+        ]
+
+    @property
+    def records_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return f"{self.import_format} import of {self.document_type}s #{self.pk} ({self.status})"
+
+
+# one section of Contract.terms_conditions, so clients can read and edit a single clause
+class ContractSection(models.Model):
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE, related_name='terms_sections')
+    position = models.PositiveIntegerField()
+    title = models.CharField(max_length=255, blank=True)
+    content = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['contract', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['contract', 'position'], name='contractsection_position_unique'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+# denormalized copy of Report.data['sections'] so sections can be queried by index
+class ReportSection(models.Model):
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, related_name='sections')
+    position = models.PositiveIntegerField()
+    name = models.CharField(max_length=255)
+    report_date = models.DateField()
+    department = models.CharField(max_length=100)
+    data = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['report', 'position']
+        indexes = [
+            models.Index(fields=['name', 'report_date'], name='reportsection_name_date_idx'),
+            models.Index(fields=['department', 'name'], name='reportsection_department_idx'),
+            models.Index(fields=['report_date'], name='reportsection_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+# content-addressed file: identical uploads share one stored copy
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100)
+    file = models.FileField(upload_to='blobs/')
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def add_references(cls, blob_ids, delta=1):
+        counts = {}
+        for blob_id in blob_ids:
+            if blob_id:
+                counts[blob_id] = counts.get(blob_id, 0) + delta
+        for blob_id, count in counts.items():
+            cls.objects.filter(pk=blob_id).update(ref_count=models.F('ref_count') + count)
+
+    def __str__(self):
+        return self.sha256
+
+
+class UploadSession(models.Model):
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETE = 'complete'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    # optional sha256 the client expects, checked on completion
+    checksum = models.CharField(max_length=64, blank=True)
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=[
+        (STATUS_OPEN, 'Open'),
+        (STATUS_COMPLETE, 'Complete'),
+    ], default=STATUS_OPEN)
+    blob = models.ForeignKey(Blob, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_sessions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+
 class Attachment(models.Model):
     contract = models.ForeignKey(Contract, on_delete=models.CASCADE, null=True, blank=True, related_name='attachments')
     report = models.ForeignKey(Report, on_delete=models.CASCADE, null=True, blank=True, related_name='attachments')
@@ -93,6 +369,26 @@ class Attachment(models.Model):
     file = models.FileField(upload_to='attachments/')
     description = models.CharField(max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # set for chunked uploads; file then points at the blob's stored copy
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='attachments')
+    filename = models.CharField(max_length=255, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    checksum = models.CharField(max_length=64, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+
+    def save(self, *args, **kwargs):
+        if self.blob_id and not self.file:
+            self.file = self.blob.file.name
+            self.size = self.blob.size
+            self.checksum = self.blob.sha256
+            self.content_type = self.blob.content_type
+        super().save(*args, **kwargs)
+
+    # the clone points at the same stored file
+    def clone(self, **document):
+        return Attachment(file=self.file.name, description=self.description, blob_id=self.blob_id,
+                          filename=self.filename, size=self.size, checksum=self.checksum,
+                          content_type=self.content_type, **document)
 
     def __str__(self):
         return self.description
@@ -0,0 +1,190 @@
+import difflib
+import json
+import zlib
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Contract, Report, Note, Revision
+from .signals import documents_bulk_created
+
+# a full snapshot every SNAPSHOT_EVERY revisions (numbers 1, 11, 21, ...), so
+# rebuilding any revision decodes at most SNAPSHOT_EVERY payloads
+SNAPSHOT_EVERY = 10
+UNTRACKED_FIELDS = {'id', 'unique_id', 'author', 'created_at', 'updated_at'}
+DOCUMENT_MODELS = (Contract, Report, Note)
+
+
+def tracked_fields(model):
+    return [field for field in model._meta.concrete_fields if field.name not in UNTRACKED_FIELDS]
+
+
+def is_line_field(field):
+    # text and JSON are stored as line deltas, everything else whole
+    return isinstance(field, (models.TextField, models.JSONField))
+
+
+def document_state(document):
+    # JSON-ready values; JSON fields as canonical text so they diff line by line
+    state = {}
+    for field in tracked_fields(type(document)):
+        value = getattr(document, field.attname)
+        if isinstance(field, models.JSONField):
+            value = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True, indent=1, ensure_ascii=False)
+        state[field.attname] = json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+    return state
+
+
+def encode_payload(payload):
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 6)
+
+
+def decode_payload(payload):
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def diff_lines(old, new):
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [[i1, i2, new_lines[j1:j2]] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def apply_lines(old, ops):
+    lines = old.splitlines(keepends=True)
+    # applied back to front so earlier offsets stay valid
+    for start, end, replacement in reversed(ops):
+        lines[start:end] = replacement
+    return ''.join(lines)
+
+
+def make_delta(model, old, new):
+    delta = {}
+    for field in tracked_fields(model):
+        name = field.attname
+        if old.get(name) == new.get(name):
+            continue
+        if is_line_field(field) and isinstance(old.get(name), str) and isinstance(new.get(name), str):
+            delta[name] = {'ops': diff_lines(old[name], new[name])}
+        else:
+            delta[name] = {'value': new.get(name)}
+    return delta
+
+
+def apply_delta(state, delta):
+    state = dict(state)
+    for name, change in delta.items():
+        state[name] = apply_lines(state[name], change['ops']) if 'ops' in change else change['value']
+    return state
+
+
+def revision_filter(document):
+    return {'content_type': ContentType.objects.get_for_model(document), 'object_id': document.pk}
+
+
+def snapshot_number(number):
+    return number - (number - 1) % SNAPSHOT_EVERY
+
+
+def state_at(document, number):
+    # one query: the nearest snapshot at or before `number` plus the deltas after it
+    revisions = Revision.objects.filter(
+        **revision_filter(document), number__gte=snapshot_number(number), number__lte=number,
+    ).order_by('number').values_list('number', 'is_snapshot', 'payload')
+
+    state = None
+    found = None
+    for found, is_snapshot, payload in revisions:
+        if state is None and not is_snapshot:
+            raise Revision.DoesNotExist(f'The snapshot before revision {number} does not exist')
+        payload = decode_payload(payload)
+        state = payload if is_snapshot else apply_delta(state, payload)
+    if found != number:
+        raise Revision.DoesNotExist(f'Revision {number} does not exist')
+    return state
+
+
+def snapshot_revision(document, author_id=None):
+    state = document_state(document)
+    return Revision(
+        **revision_filter(document), number=1, version=document.version, is_snapshot=True,
+        payload=encode_payload(state), changed_fields=list(state), author_id=author_id,
+    )
+
+
+def next_revision(document, author_id=None):
+    latest = Revision.objects.filter(**revision_filter(document)).order_by('-number').values_list(
+        'number', flat=True).first()
+    if latest is None:
+        return snapshot_revision(document, author_id)
+
+    current = document_state(document)
+    delta = make_delta(type(document), state_at(document, latest), current)
+    if not delta:
+        return None
+    number = latest + 1
+    is_snapshot = snapshot_number(number) == number
+    return Revision(
+        **revision_filter(document), number=number, version=document.version, is_snapshot=is_snapshot,
+        payload=encode_payload(current if is_snapshot else delta), changed_fields=list(delta), author_id=author_id,
+    )
+
+
+def record_revision(document, author_id=None, attempts=3):
+    for _ in range(attempts):
+        revision = next_revision(document, author_id)
+        if revision is None:
+            return None
+        try:
+            with transaction.atomic():
+                revision.save()
+            return revision
+        except IntegrityError:
+            # a concurrent save took this number, diff against its revision instead
+            continue
+    return None
+
+
+def load_state(model, state):
+    # JSON fields back from their canonical text
+    state = dict(state)
+    for field in tracked_fields(model):
+        if isinstance(field, models.JSONField) and isinstance(state.get(field.attname), str):
+            state[field.attname] = json.loads(state[field.attname])
+    return state
+
+
+def diff_states(model, old, new):
+    changes = {}
+    for field in tracked_fields(model):
+        name = field.attname
+        if old.get(name) == new.get(name):
+            continue
+        if is_line_field(field) and isinstance(old.get(name), str) and isinstance(new.get(name), str):
+            changes[field.name] = {'diff': ''.join(difflib.unified_diff(
+                old[name].splitlines(keepends=True), new[name].splitlines(keepends=True),
+                fromfile=field.name, tofile=field.name,
+            ))}
+        else:
+            changes[field.name] = {'from': old.get(name), 'to': new.get(name)}
+    return changes
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_save, sender=Report)
+@receiver(post_save, sender=Note)
+def record_saved_document(sender, instance, created, **kwargs):
+    author_id = getattr(instance, '_revision_author_id', None) or (instance.author_id if created else None)
+    record_revision(instance, author_id)
+
+
+@receiver(documents_bulk_created)
+def record_bulk_created_documents(sender, documents, **kwargs):
+    if sender in DOCUMENT_MODELS:
+        Revision.objects.bulk_create(
+            [snapshot_revision(document, document.author_id) for document in documents if document.pk],
+            batch_size=500,
+        )
@@ -1,5 +1,62 @@
+import os
+
 from rest_framework import serializers
-from .models import DocumentType, Contract, Report, Note, Attachment
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from .cache import get_representations, set_representations
+from .models import (
+    TERMS_HEADING_LINE, DocumentType, Contract, Report, Note, Attachment, Blob, UploadSession, ImportJob,
+    ContractSection,
+)
+from .imports import IMPORT_FORMATS, IMPORT_TYPES, format_from_name, save_source
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    # batch validation passes a shared 'related_cache' so each related pk is fetched once
+    def to_internal_value(self, data):
+        related_cache = self.context.get('related_cache')
+        if related_cache is None:
+            return super().to_internal_value(data)
+
+        key = (self.field_name, str(data))
+        if key not in related_cache:
+            related_cache[key] = super().to_internal_value(data)
+        return related_cache[key]
+
+
+def cached_representations(serializer, instances):
+    # one get_many for all instances; related rows ('prefetch' in the context) are only loaded for misses
+    request = serializer.context.get('request')
+    cached = get_representations(instances, request)
+    misses = [instance for instance in instances if instance.pk not in cached]
+    if misses:
+        prefetch_related_objects(misses, *serializer.context.get('prefetch', ()))
+        representations = [serializer.serialize(instance) for instance in misses]
+        set_representations(misses, representations, request)
+        cached.update((instance.pk, data) for instance, data in zip(misses, representations))
+    return [cached[instance.pk] for instance in instances]
+
+
+class CachedListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        instances = data.all() if hasattr(data, 'all') else data
+        return cached_representations(self.child, list(instances))
+
+
+class CachedRepresentationMixin:
+    """
+    Caches to_representation() per document, stamped with version/updated_at.
+    Stale stamps are misses; saves and deletes also drop entries (documents/signals.py).
+    """
+
+    def serialize(self, instance):
+        return super().to_representation(instance)
+
+    def to_representation(self, instance):
+        if not instance.pk:
+            return self.serialize(instance)
+        return cached_representations(self, [instance])[0]
 
 
 class DocumentTypeSerializer(serializers.ModelSerializer):
@@ -11,42 +68,139 @@ class DocumentTypeSerializer(serializers.ModelSerializer):
 class AttachmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Attachment
-        fields = ['id', 'file', 'description', 'uploaded_at']
+        fields = ['id', 'file', 'description', 'uploaded_at', 'filename', 'size', 'content_type']
 
 
-class ContractSerializer(serializers.ModelSerializer):
+class BlobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Blob
+        fields = ['id', 'sha256', 'size', 'content_type']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    blob = BlobSerializer(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'checksum', 'received', 'status', 'blob', 'created_at']
+        read_only_fields = ['id', 'received', 'status', 'created_at']
+
+    def validate_filename(self, value):
+        value = os.path.basename(value.replace('\\', '/')).strip()
+        if not value:
+            raise serializers.ValidationError('Expected a file name')
+        return value
+
+    def validate_size(self, value):
+        if value > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Uploads are limited to {settings.UPLOAD_MAX_SIZE} bytes')
+        return value
+
+    def validate_checksum(self, value):
+        value = value.lower()
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value)):
+            raise serializers.ValidationError('Expected a hex sha256 digest')
+        return value
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    file = serializers.FileField(write_only=True)
+    document_type = serializers.ChoiceField(choices=list(IMPORT_TYPES))
+    import_format = serializers.ChoiceField(choices=IMPORT_FORMATS, required=False)
+    records_per_second = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'file', 'document_type', 'import_format', 'status', 'processed', 'imported', 'failed',
+                  'errors', 'error', 'records_per_second', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = ['id', 'status', 'processed', 'imported', 'failed', 'errors', 'error',
+                            'records_per_second', 'created_at', 'started_at', 'finished_at']
+
+    def validate(self, attrs):
+        # the format defaults to the file's extension (.ndjson, .jsonl, .csv)
+        if 'import_format' not in attrs:
+            import_format = format_from_name(attrs['file'].name)
+            if import_format not in IMPORT_FORMATS:
+                raise serializers.ValidationError({'import_format': 'Could not infer the format from the file name'})
+            attrs['import_format'] = import_format
+        return attrs
+
+    def create(self, validated_data):
+        uploaded = validated_data.pop('file')
+        # committed together, so a worker never claims a job whose file is still being written
+        with transaction.atomic():
+            job = super().create(validated_data)
+            save_source(job, uploaded.chunks())
+        return job
+
+
+class ContractSerializer(CachedRepresentationMixin, serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
     attachments = AttachmentSerializer(many=True, read_only=True)
 
     class Meta:
         model = Contract
+        list_serializer_class = CachedListSerializer
         fields = ['id', 'title', 'document_type', 'unique_id', 'author', 'status',
                   'version', 'created_at', 'updated_at', 'party_name', 'start_date',
                   'end_date', 'contract_value', 'terms_conditions', 'attachments', 'custom_notes']
         read_only_fields = ['id', 'unique_id', 'created_at', 'updated_at']
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
+    def serialize(self, instance):
+        ret = super().serialize(instance)
         if instance.version == 1 or ret['custom_notes'] is None:
             ret.pop('custom_notes', None)
         return ret
 
 
-class ReportSerializer(serializers.ModelSerializer):
+class ContractSectionSerializer(serializers.ModelSerializer):
+    # position is where POST inserts the section (default: the end); sections are addressed by it
+    position = serializers.IntegerField(min_value=0, required=False)
+
+    class Meta:
+        model = ContractSection
+        fields = ['position', 'title', 'content']
+        extra_kwargs = {'title': {'trim_whitespace': False}, 'content': {'trim_whitespace': False}}
+
+    def validate_title(self, value):
+        if '\n' in value or '\r' in value:
+            raise serializers.ValidationError('Section titles are a single line')
+        return value
+
+    def validate_content(self, value):
+        # a heading line inside the content would split the sections differently when the terms are re-read
+        if TERMS_HEADING_LINE.search(value):
+            raise serializers.ValidationError(
+                'Content cannot contain a "## " heading line, insert a new section instead')
+        return value
+
+    def validate(self, attrs):
+        # only the first section may be an untitled preamble, which inserts can't create
+        if self.instance is None and not attrs.get('title', '').strip():
+            raise serializers.ValidationError({'title': 'New sections need a title'})
+        return attrs
+
+
+class ReportSerializer(CachedRepresentationMixin, serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
     attachments = AttachmentSerializer(many=True, read_only=True)
 
     class Meta:
         model = Report
+        list_serializer_class = CachedListSerializer
         fields = ['id', 'title', 'document_type', 'unique_id', 'author', 'status',
                   'version', 'created_at', 'updated_at', 'report_date', 'department',
                   'summary', 'data', 'attachments']
         read_only_fields = ['id', 'unique_id', 'created_at', 'updated_at']
 
 
-class NoteSerializer(serializers.ModelSerializer):
+class NoteSerializer(CachedRepresentationMixin, serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
     attachments = AttachmentSerializer(many=True, read_only=True)
 
     class Meta:
         model = Note
+        list_serializer_class = CachedListSerializer
         fields = ['id', 'title', 'document_type', 'unique_id', 'author', 'status',
                   'version', 'created_at', 'updated_at', 'content', 'priority', 'attachments']
         read_only_fields = ['id', 'unique_id', 'created_at', 'updated_at']
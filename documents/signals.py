@@ -0,0 +1,76 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .cache import invalidate_representation, touch_list_watermark
+
+# bulk_create skips post_save, so batch writers announce the new rows themselves
+documents_bulk_created = Signal()
+
+
+# attachments are part of the document's representation, so changing them bumps updated_at
+@receiver([post_save, post_delete], sender='documents.Attachment')
+def touch_attachment_document(sender, instance, **kwargs):
+    for field_name in ('contract', 'report', 'note'):
+        document_id = getattr(instance, f'{field_name}_id')
+        if document_id:
+            model = instance._meta.get_field(field_name).related_model
+            model.objects.filter(pk=document_id).update(updated_at=timezone.now())
+            invalidate_representation(model, document_id)
+            touch_list_watermark(model)
+
+
+# bulk writers (clone_many) adjust blob references themselves
+@receiver(post_save, sender='documents.Attachment')
+def reference_attachment_blob(sender, instance, created, **kwargs):
+    if created and instance.blob_id:
+        instance._meta.get_field('blob').related_model.add_references([instance.blob_id])
+
+
+@receiver(post_delete, sender='documents.Attachment')
+def release_attachment_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        instance._meta.get_field('blob').related_model.add_references([instance.blob_id], delta=-1)
+
+
+# fields each sectioned model derives its section rows from
+SECTION_FIELDS = {
+    'documents.Report': {'data', 'report_date', 'department'},
+    'documents.Contract': {'terms_conditions'},
+}
+
+
+@receiver(post_save, sender='documents.Report')
+@receiver(post_save, sender='documents.Contract')
+def sync_document_sections(sender, instance, update_fields=None, **kwargs):
+    # section endpoints write the rows themselves and only materialize the text
+    if instance.__dict__.pop('_sections_synced', False):
+        return
+    if update_fields is None or SECTION_FIELDS[sender._meta.label] & set(update_fields):
+        sender.sync_sections([instance])
+
+
+@receiver(documents_bulk_created)
+def sync_bulk_created_sections(sender, documents, **kwargs):
+    if sender._meta.label in SECTION_FIELDS:
+        sender.sync_sections(documents)
+
+
+@receiver([post_save, post_delete], sender='documents.Contract')
+@receiver([post_save, post_delete], sender='documents.Report')
+@receiver([post_save, post_delete], sender='documents.Note')
+def invalidate_document_representation(sender, instance, **kwargs):
+    invalidate_representation(sender, instance.pk)
+
+
+# list ETags and Last-Modified follow a per-table watermark, see DocumentConditionalGetMixin
+@receiver([post_save, post_delete], sender='documents.Contract')
+@receiver([post_save, post_delete], sender='documents.Report')
+@receiver([post_save, post_delete], sender='documents.Note')
+def touch_document_list_watermark(sender, **kwargs):
+    touch_list_watermark(sender)
+
+
+@receiver(documents_bulk_created)
+def touch_bulk_created_list_watermark(sender, **kwargs):
+    touch_list_watermark(sender)
@@ -1,3 +1,827 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    DocumentType, Contract, Report, ReportSection, Note, Attachment, Blob, Revision, ImportJob, ContractSection,
+)
+from .cache import list_watermark_key
+from .uploads import collect_garbage
+from .analytics import extract_values, store
+from .revisions import SNAPSHOT_EVERY, state_at
+from .imports import claim_import_job, run_import, save_source
+from .builders import ContractBuilder, DocumentDirector
+from .views import ContractViewSet
+
+
+class DocumentAPITestCase(TestCase):
+    def setUp(self):
+        caches['representations'].clear()
+        caches['default'].clear()
+        self.user = User.objects.create_user('author', password='password')
+        self.document_type = DocumentType.objects.create(name='General')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_contract(self):
+        contract = Contract.objects.create(
+            title='Contract', author=self.user, document_type=self.document_type,
+            party_name='ACME', start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1),
+            contract_value=1000, terms_conditions='Terms',
+        )
+        Attachment.objects.create(contract=contract, file='attachments/contract.pdf', description='Scan')
+        return contract
+
+    def create_report(self):
+        report = Report.objects.create(
+            title='Report', author=self.user, document_type=self.document_type,
+            report_date=datetime.date(2024, 1, 1), department='Finance', summary='Summary',
+        )
+        Attachment.objects.create(report=report, file='attachments/report.xlsx', description='Sheet')
+        return report
+
+    def create_note(self):
+        note = Note.objects.create(title='Note', author=self.user, document_type=self.document_type, content='Content')
+        Attachment.objects.create(note=note, file='attachments/note.txt', description='Text')
+        return note
+
+
+class DocumentListQueryCountTests(DocumentAPITestCase):
+    # page + attachments prefetch, the list ETag watermark is cached
+    def assert_constant_list_queries(self, url, create):
+        create()
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+        for _ in range(10):
+            create()
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_contract_list_query_count(self):
+        self.assert_constant_list_queries('/api/contracts/', self.create_contract)
+
+    def test_report_list_query_count(self):
+        self.assert_constant_list_queries('/api/reports/', self.create_report)
+
+    def test_note_list_query_count(self):
+        self.assert_constant_list_queries('/api/notes/', self.create_note)
+
+    def test_contract_detail_query_count(self):
+        contract = self.create_contract()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/contracts/{contract.pk}/')
+        self.assertEqual(len(response.data['attachments']), 1)
+
+    def test_contract_list_is_cursor_paginated(self):
+        for _ in range(3):
+            self.create_contract()
+        response = self.client.get('/api/contracts/?page_size=2')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn('count', response.data)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ConditionalGetTests(DocumentAPITestCase):
+    def test_detail_not_modified_skips_the_full_query(self):
+        contract = self.create_contract()
+        url = f'/api/contracts/{contract.pk}/'
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        contract.title = 'Renamed'
+        contract.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_etag_follows_attachments(self):
+        contract = self.create_contract()
+        url = f'/api/contracts/{contract.pk}/'
+        etag = self.client.get(url)['ETag']
+        Attachment.objects.create(contract=contract, file='attachments/extra.pdf', description='Extra')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_etag_uses_table_watermark(self):
+        contract = self.create_contract()
+        etag = self.client.get('/api/contracts/')['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/contracts/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # other query strings are other representations
+        self.assertNotEqual(self.client.get('/api/contracts/?page_size=1')['ETag'], etag)
+
+        contract.delete()
+        self.assertEqual(self.client.get('/api/contracts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_last_modified_moves_on_delete(self):
+        contract = self.create_contract()
+        # Last-Modified has one second granularity, start from a watermark a minute back
+        caches['default'].set(list_watermark_key(Contract), time.time() - 60, timeout=None)
+        last_modified = self.client.get('/api/contracts/')['Last-Modified']
+        self.assertEqual(
+            self.client.get('/api/contracts/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        contract.delete()
+        self.assertEqual(
+            self.client.get('/api/contracts/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+
+class RepresentationCacheTests(DocumentAPITestCase):
+    def test_warm_list_skips_attachment_queries(self):
+        for _ in range(5):
+            self.create_contract()
+        cold = self.client.get('/api/contracts/').data
+        # just the page, attachments come from cached representations
+        with self.assertNumQueries(1):
+            warm = self.client.get('/api/contracts/').data
+        self.assertEqual(warm, cold)
+
+    def test_detail_reuses_list_fragments(self):
+        contract = self.create_contract()
+        self.client.get('/api/contracts/')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/contracts/{contract.pk}/')
+        self.assertEqual(len(response.data['attachments']), 1)
+        self.assertNotIn('custom_notes', response.data)
+
+    def test_changes_invalidate_representations(self):
+        contract = self.create_contract()
+        url = f'/api/contracts/{contract.pk}/'
+        self.client.get(url)
+
+        Attachment.objects.create(contract=contract, file='attachments/extra.pdf', description='Extra')
+        self.assertEqual(len(self.client.get(url).data['attachments']), 2)
+
+        contract.refresh_from_db()
+        contract.custom_notes = 'Reviewed'
+        contract.version = 2
+        contract.save()
+        self.assertEqual(self.client.get(url).data['custom_notes'], 'Reviewed')
+
+        contract.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class RevisionTests(DocumentAPITestCase):
+    def test_edits_are_stored_as_deltas_between_snapshots(self):
+        contract = self.create_contract()
+        clauses = [f'Clause {number}: the parties agree to term {number}.\n' for number in range(2000)]
+        texts = []
+        for edit in range(SNAPSHOT_EVERY + 3):
+            clauses[edit * 7] = f'Clause {edit * 7}: amended in edit {edit}.\n'
+            # the serializer trims surrounding whitespace
+            texts.append(''.join(clauses).strip())
+            response = self.client.patch(f'/api/contracts/{contract.pk}/', {'terms_conditions': texts[-1]},
+                                         format='json')
+            self.assertEqual(response.status_code, 200)
+
+        revisions = list(Revision.objects.filter(object_id=contract.pk).order_by('number'))
+        self.assertEqual(len(revisions), SNAPSHOT_EVERY + 4)
+        self.assertEqual([r.number for r in revisions if r.is_snapshot], [1, SNAPSHOT_EVERY + 1])
+        self.assertEqual(revisions[1].author_id, self.user.pk)
+        # a one-line delta is a small fraction of a snapshot
+        self.assertLess(len(revisions[2].payload) * 20, len(revisions[SNAPSHOT_EVERY].payload))
+
+        for number, text in enumerate(texts, start=2):
+            self.assertEqual(state_at(contract, number)['terms_conditions'], text)
+
+    def test_saves_without_changes_add_no_revision(self):
+        contract = self.create_contract()
+        contract.save()
+        self.assertEqual(Revision.objects.filter(object_id=contract.pk).count(), 1)
+
+    def test_history_and_diff_endpoints(self):
+        report = Report.objects.create(
+            title='Report', author=self.user, document_type=self.document_type,
+            report_date=datetime.date(2024, 1, 1), department='Finance', summary='Line one\nLine two\n',
+            data={'sections': [{'name': 'Q1', 'data': 1}]},
+        )
+        self.client.patch(f'/api/reports/{report.pk}/', {
+            'summary': 'Line one\nLine 2\n', 'data': {'sections': [{'name': 'Q1', 'data': 2}]}, 'status': 'review',
+        }, format='json')
+
+        history = self.client.get(f'/api/reports/{report.pk}/history/').data
+        self.assertEqual([entry['revision'] for entry in history], [2, 1])
+        self.assertEqual(sorted(history[0]['changed_fields']), ['data', 'status', 'summary'])
+
+        fields = self.client.get(f'/api/reports/{report.pk}/history/', {'revision': 1}).data['fields']
+        self.assertEqual(fields['data'], {'sections': [{'name': 'Q1', 'data': 1}]})
+
+        changes = self.client.get(f'/api/reports/{report.pk}/diff/').data['changes']
+        self.assertIn('-Line two', changes['summary']['diff'])
+        self.assertIn('+Line 2', changes['summary']['diff'])
+        self.assertEqual(changes['status'], {'from': 'draft', 'to': 'review'})
+
+        self.assertEqual(self.client.get(f'/api/reports/{report.pk}/diff/', {'to': 5}).status_code, 400)
+
+    def test_history_and_diff_without_revisions(self):
+        note = self.create_note()
+        Revision.objects.filter(object_id=note.pk).delete()
+        self.assertEqual(self.client.get(f'/api/notes/{note.pk}/history/').data, [])
+        self.assertEqual(self.client.get(f'/api/notes/{note.pk}/history/', {'revision': ''}).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/notes/{note.pk}/diff/').status_code, 404)
+
+    def test_history_of_a_missing_revision(self):
+        note = self.create_note()
+        note.content = 'Changed'
+        note.save()
+        # a gap before the latest revision, e.g. a row removed by hand
+        Revision.objects.filter(object_id=note.pk, number=1).delete()
+        for revision in (1, 2):
+            response = self.client.get(f'/api/notes/{note.pk}/history/', {'revision': revision})
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(f'/api/notes/{note.pk}/diff/').status_code, 404)
+
+    def test_deleting_a_document_removes_its_revisions(self):
+        note = Note.objects.create(title='Note', author=self.user, document_type=self.document_type, content='Text')
+        note.delete()
+        self.assertFalse(Revision.objects.exists())
+
+
+class DocumentBulkCreateTests(DocumentAPITestCase):
+    def contract_payload(self, title):
+        return {
+            'title': title, 'document_type': self.document_type.pk, 'party_name': 'ACME',
+            'start_date': '2024-01-01', 'end_date': '2025-01-01', 'contract_value': '1000.00',
+            'terms_conditions': 'Terms',
+        }
+
+    def test_bulk_create(self):
+        response = self.client.post('/api/contracts/bulk_create/', {
+            'documents': [self.contract_payload(f'Contract {number}') for number in range(3)],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 0))
+
+        contracts = Contract.objects.order_by('pk')
+        self.assertEqual([result['id'] for result in response.data['results']], [c.pk for c in contracts])
+        self.assertEqual([c.title for c in contracts], ['Contract 0', 'Contract 1', 'Contract 2'])
+        self.assertTrue(all(c.author == self.user for c in contracts))
+        self.assertEqual(Revision.objects.filter(object_id__in=[c.pk for c in contracts]).count(), 3)
+
+    def test_bulk_create_limit(self):
+        with mock.patch.object(ContractViewSet, 'bulk_create_max_items', 2):
+            response = self.client.post('/api/contracts/bulk_create/', [
+                self.contract_payload(f'Contract {number}') for number in range(3)
+            ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Contract.objects.exists())
+
+        self.assertEqual(self.client.post('/api/contracts/bulk_create/', {}, format='json').status_code, 400)
+
+    def test_invalid_item_creates_nothing(self):
+        response = self.client.post('/api/contracts/bulk_create/', [
+            self.contract_payload('Valid'), {**self.contract_payload('Invalid'), 'start_date': 'soon'}, 'text',
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['created'], response.data['failed']), (0, 2))
+        self.assertEqual(response.data['results'][0], {'index': 0})
+        self.assertIn('start_date', response.data['results'][1]['errors'])
+        self.assertIn('non_field_errors', response.data['results'][2]['errors'])
+        self.assertFalse(Contract.objects.exists())
+
+    def test_failed_insert_rolls_back_the_batch(self):
+        # the revision snapshots are written in the same transaction as the documents
+        with mock.patch.object(Revision.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.post('/api/contracts/bulk_create/', [
+                    self.contract_payload(f'Contract {number}') for number in range(3)
+                ], format='json')
+        self.assertFalse(Contract.objects.exists())
+
+
+class DocumentCloneTests(DocumentAPITestCase):
+    def test_clone_returns_fresh_copy_each_time(self):
+        contract = self.create_contract()
+        first = contract.clone()
+        first.save()
+        second = contract.clone()
+        self.assertIsNone(second.pk)
+        self.assertNotEqual(first.unique_id, second.unique_id)
+        self.assertEqual(second.version, contract.version + 1)
+
+    def test_clone_many_copies_attachments(self):
+        contracts = [self.create_contract() for _ in range(3)]
+        response = self.client.post('/api/contracts/clone_many/', {
+            'ids': [contract.pk for contract in contracts],
+            'with_attachments': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['cloned']), 3)
+        self.assertEqual(Attachment.objects.filter(contract__version=2).count(), 3)
+
+
+class ReportSectionTests(DocumentAPITestCase):
+    def create_sectioned_report(self, department, report_date, *names):
+        return Report.objects.create(
+            title='Report', author=self.user, document_type=self.document_type,
+            report_date=report_date, department=department, summary='Summary',
+            data={'sections': [{'name': name, 'data': {'value': 1}} for name in names]},
+        )
+
+    def test_sections_follow_report_data(self):
+        report = self.create_sectioned_report('Finance', datetime.date(2024, 7, 1), 'Q3 revenue', 'Costs')
+        self.assertEqual(list(report.sections.values_list('name', flat=True)), ['Q3 revenue', 'Costs'])
+
+        report.data = {'sections': [{'name': 'Headcount', 'data': 3}]}
+        report.department = 'HR'
+        report.save()
+        self.assertEqual(list(report.sections.values_list('name', 'department')), [('Headcount', 'HR')])
+
+    def test_bulk_created_reports_get_sections(self):
+        response = self.client.post('/api/reports/bulk_create/', [{
+            'title': 'Report', 'document_type': self.document_type.pk, 'report_date': '2024-07-01',
+            'department': 'Finance', 'summary': 'Summary', 'data': {'sections': [{'name': 'Q3 revenue'}]},
+        }], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ReportSection.objects.filter(name='Q3 revenue').count(), 1)
+
+    def test_list_filters_by_section(self):
+        q3 = self.create_sectioned_report('Finance', datetime.date(2024, 7, 1), 'Q3 revenue')
+        self.create_sectioned_report('Sales', datetime.date(2024, 7, 1), 'Q3 revenue')
+        self.create_sectioned_report('Finance', datetime.date(2023, 7, 1), 'Q3 revenue')
+        self.create_sectioned_report('Finance', datetime.date(2024, 7, 1), 'Costs')
+
+        response = self.client.get('/api/reports/', {
+            'section': 'Q3 revenue', 'department': 'Finance', 'report_date_after': '2024-01-01',
+        })
+        self.assertEqual([report['id'] for report in response.data['results']], [q3.pk])
+
+        response = self.client.get('/api/reports/', {'section': ['Q3 revenue', 'Costs']})
+        self.assertEqual(len(response.data['results']), 4)
+
+        response = self.client.get('/api/reports/', {'report_date_before': 'July'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ReportAnalyticsTests(DocumentAPITestCase):
+    def setUp(self):
+        super().setUp()
+        store.clear()
+
+    def create_revenue_report(self, department, report_date, revenue, costs=None):
+        return Report.objects.create(
+            title='Report', author=self.user, document_type=self.document_type,
+            report_date=report_date, department=department, summary='Summary',
+            data={'sections': [{'name': 'revenue', 'data': revenue},
+                               {'name': 'costs', 'data': costs or {'rent': 10, 'wages': [1, 2]}}]},
+        )
+
+    def analytics(self, **params):
+        response = self.client.get('/api/reports/analytics/', params)
+        self.assertEqual(response.status_code, 200)
+        return {(row['metric'], row.get('department'), row.get('month')): row for row in response.data['groups']}
+
+    def test_grouped_aggregations_match_numpy(self):
+        values = [5, 1, 9, 4, 7]
+        for value in values:
+            self.create_revenue_report('Finance', datetime.date(2024, 7, value), value)
+        self.create_revenue_report('Finance', datetime.date(2024, 8, 1), 100)
+        self.create_revenue_report('Sales', datetime.date(2024, 7, 1), 50)
+
+        groups = self.analytics(percentiles='25,50,90')
+        july = groups[('revenue', 'Finance', '2024-07')]
+        self.assertEqual(july['count'], 5)
+        self.assertEqual(july['sum'], 26)
+        self.assertEqual(july['min'], 1)
+        self.assertEqual(july['max'], 9)
+        for percentile in (25, 50, 90):
+            self.assertAlmostEqual(july[f'p{percentile}'], np.percentile(values, percentile))
+        self.assertEqual(groups[('costs.wages', 'Finance', '2024-07')]['count'], 10)
+
+        groups = self.analytics(group_by='department', metric='revenue', department='Finance')
+        self.assertEqual(list(groups), [('revenue', 'Finance', None)])
+        self.assertEqual(groups[('revenue', 'Finance', None)]['sum'], 126)
+
+    def test_cache_follows_report_changes(self):
+        report = self.create_revenue_report('Finance', datetime.date(2024, 7, 1), 10)
+        other = self.create_revenue_report('Finance', datetime.date(2024, 7, 2), 20)
+        self.assertEqual(self.analytics(metric='revenue')[('revenue', 'Finance', '2024-07')]['sum'], 30)
+
+        report.data = {'sections': [{'name': 'revenue', 'data': 15}]}
+        report.save()
+        other.delete()
+        self.assertEqual(self.analytics(metric='revenue')[('revenue', 'Finance', '2024-07')]['sum'], 15)
+
+    def test_non_finite_values_are_skipped(self):
+        self.assertEqual(list(extract_values('costs', {'rent': float('inf'), 'wages': [1, float('nan'), 2]})),
+                         [('costs.wages', 1.0), ('costs.wages', 2.0)])
+        self.assertEqual(list(extract_values('revenue', float('-inf'))), [])
+
+        # 1e999 is valid JSON for the database and reads back as inf
+        report = self.create_revenue_report('Finance', datetime.date(2024, 7, 1), 0)
+        self.create_revenue_report('Finance', datetime.date(2024, 7, 2), 5)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {ReportSection._meta.db_table} SET data = %s WHERE report_id = %s AND name = 'revenue'",
+                ['[1e999, -1e999]', report.pk],
+            )
+        groups = self.analytics(group_by='department', metric='revenue')
+        self.assertEqual((groups[('revenue', 'Finance', None)]['count'], groups[('revenue', 'Finance', None)]['sum']),
+                         (1, 5))
+
+    def test_refresh_skips_the_scan_until_the_watermark_moves(self):
+        report = self.create_revenue_report('Finance', datetime.date(2024, 7, 1), 10)
+        columns = store.refresh()
+        with self.assertNumQueries(0):
+            self.assertIs(store.refresh(), columns)
+
+        # a write seen only through the shared watermark, as from another process
+        Report.objects.filter(pk=report.pk).update(
+            department='Procurement', updated_at=report.updated_at + datetime.timedelta(seconds=1))
+        ReportSection.objects.filter(report=report).update(department='Procurement')
+        self.assertNotIn('Procurement', store.refresh()['departments'])
+        caches['default'].delete(list_watermark_key(Report))
+        self.assertEqual(self.analytics(metric='revenue')[('revenue', 'Procurement', '2024-07')]['sum'], 10)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/reports/analytics/', {'group_by': 'title'}).status_code, 400)
+        for percentiles in ('101', '-1', 'median', '50,nan'):
+            response = self.client.get('/api/reports/analytics/', {'percentiles': percentiles})
+            self.assertEqual(response.status_code, 400, percentiles)
+
+
+class UploadTestCase(DocumentAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root.name, 'media'),
+            UPLOAD_SESSIONS_ROOT=os.path.join(self.root.name, 'uploads'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def start(self, content, filename='scan.pdf'):
+        response = self.client.post('/api/uploads/', {
+            'filename': filename,
+            'size': len(content),
+            'checksum': hashlib.sha256(content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def send(self, upload_id, chunk, offset):
+        return self.client.patch(f'/api/uploads/{upload_id}/chunk/', chunk,
+                                 content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self, content, filename='scan.pdf'):
+        upload_id = self.start(content, filename)
+        self.send(upload_id, content, 0)
+        return self.client.post(f'/api/uploads/{upload_id}/complete/').data
+
+
+class UploadTests(UploadTestCase):
+    def test_chunked_upload_resumes_from_received_offset(self):
+        content = b'%PDF-1.4 ' + b'x' * 1000
+        upload_id = self.start(content)
+        self.assertEqual(self.send(upload_id, content[:400], 0).status_code, 200)
+
+        # a retried chunk at a stale offset is rejected with the offset to resume from
+        response = self.send(upload_id, content[:400], 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received'], 400)
+
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['received'], 400)
+        response = self.client.patch(f'/api/uploads/{upload_id}/chunk/', content[400:],
+                                     content_type='application/octet-stream',
+                                     HTTP_CONTENT_RANGE=f'bytes 400-{len(content) - 1}/{len(content)}')
+        self.assertEqual(response['Upload-Offset'], str(len(content)))
+
+        blob = self.client.post(f'/api/uploads/{upload_id}/complete/').data
+        self.assertEqual(blob['sha256'], hashlib.sha256(content).hexdigest())
+        self.assertEqual(blob['content_type'], 'application/pdf')
+        with Blob.objects.get(pk=blob['id']).file.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+
+    def test_chunk_checksum_mismatch_is_rejected(self):
+        upload_id = self.start(b'abcdef')
+        response = self.client.patch(f'/api/uploads/{upload_id}/chunk/', b'abc',
+                                     content_type='application/octet-stream',
+                                     HTTP_UPLOAD_OFFSET='0', HTTP_UPLOAD_CHECKSUM='0' * 64)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received'], 0)
+
+    def test_identical_uploads_share_a_blob_and_count_references(self):
+        first = self.upload(b'same bytes', 'a.txt')
+        second = self.upload(b'same bytes', 'b.txt')
+        self.assertEqual(first['id'], second['id'])
+        self.assertEqual(Blob.objects.count(), 1)
+
+        response = self.client.post('/api/contracts/create_with_attachments/', {
+            'title': 'Contract', 'document_type': self.document_type.pk, 'party_name': 'ACME',
+            'start_date': '2024-01-01', 'end_date': '2025-01-01', 'contract_value': 1000,
+            'attachments': [{'blob': first['id'], 'filename': 'a.txt', 'description': 'A'},
+                            {'blob': first['id'], 'filename': 'b.txt', 'description': 'B'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['attachments'][0]['size'], len(b'same bytes'))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        contract = Contract.objects.get(pk=response.data['id'])
+        Contract.clone_many([contract], with_attachments=True)
+        self.assertEqual(Blob.objects.get().ref_count, 4)
+
+        Attachment.objects.filter(contract=contract).first().delete()
+        self.assertEqual(Blob.objects.get().ref_count, 3)
+
+    def test_other_users_cannot_attach_or_resume_uploads(self):
+        blob = self.upload(b'private')
+        other = User.objects.create_user('other', password='password')
+        self.client.force_authenticate(other)
+
+        response = self.client.post('/api/contracts/create_with_attachments/', {
+            'title': 'Contract', 'document_type': self.document_type.pk,
+            'attachments': [{'blob': blob['id'], 'description': 'Stolen'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Contract.objects.exists())
+
+    def test_garbage_collection_removes_unreferenced_blobs(self):
+        blob = Blob.objects.get(pk=self.upload(b'orphan')['id'])
+        path = blob.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(collect_garbage(datetime.timedelta(0)), (0, 1))
+        self.assertFalse(os.path.exists(path))
+
+
+class AttachmentDownloadTests(UploadTestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        blob = self.upload(self.content, 'table.bin')
+        contract = self.create_contract()
+        self.attachment = Attachment.objects.create(contract=contract, blob_id=blob['id'],
+                                                    filename='table.bin', description='Table')
+        self.url = f'/api/attachments/{self.attachment.pk}/download/'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('table.bin', response['Content-Disposition'])
+        self.assertEqual(self.body(response), self.content)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(self.body(response), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(self.body(response), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+
+        # a stale If-Range falls back to the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_suffix_range_of_an_empty_file(self):
+        attachment = Attachment.objects.create(
+            contract=self.attachment.contract, file=SimpleUploadedFile('empty.txt', b''), description='Empty')
+        response = self.client.get(f'/api/attachments/{attachment.pk}/download/', HTTP_RANGE='bytes=-500')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(ATTACHMENT_SENDFILE='x-accel-redirect')
+    def test_sendfile_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected-media/blobs/'))
+        self.assertEqual(response.content, b'')
+
+    def test_only_the_document_author_can_download(self):
+        self.client.force_authenticate(User.objects.create_user('other', password='password'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get(self.url).status_code, (401, 403))
+
+
+class ImportTests(DocumentAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings_override = override_settings(IMPORT_JOBS_ROOT=self.root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def contract_lines(self, count):
+        return [json.dumps({
+            'title': f'Contract {i}', 'document_type': 'General', 'party_name': 'ACME',
+            'start_date': '2024-01-01', 'end_date': '2025-01-01', 'contract_value': f'{i}.50',
+            'terms': [{'title': 'Scope', 'content': f'Clause {i}'}],
+        }) for i in range(count)]
+
+    def make_job(self, content, document_type='contract', import_format='ndjson'):
+        job = ImportJob.objects.create(user=self.user, document_type=document_type, import_format=import_format)
+        save_source(job, [content.encode()])
+        return job
+
+    def test_ndjson_import_builds_documents_and_reports_errors(self):
+        lines = self.contract_lines(5)
+        lines.insert(2, '{"title": "Broken"')
+        lines.insert(4, json.dumps({**json.loads(lines[0]), 'document_type': 'Missing'}))
+        job = run_import(self.make_job('\n'.join(lines) + '\n'), workers=1, chunk_size=2)
+
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+        self.assertEqual((job.processed, job.imported, job.failed), (7, 5, 2))
+        self.assertEqual([error['record'] for error in job.errors], [3, 5])
+        contract = Contract.objects.get(title='Contract 3')
+        self.assertEqual(contract.contract_value, Decimal('3.50'))
+        self.assertIn('## Scope', contract.terms_conditions)
+        self.assertEqual(contract.author, self.user)
+        self.assertEqual(Revision.objects.filter(object_id=contract.pk).count(), 1)
+
+    def test_csv_report_import_with_validation_workers(self):
+        rows = ['title,document_type,report_date,department,summary,data_sections']
+        rows += [f'Report {i},{self.document_type.pk},2024-0{i % 9 + 1}-01,Finance,"Summary, {i}",'
+                 f'"{{""revenue"": {i}}}"' for i in range(20)]
+        rows.append('Bad,General,not a date,Finance,Summary,')
+        job = run_import(self.make_job('\n'.join(rows), 'report', 'csv'), workers=2, chunk_size=3)
+
+        self.assertEqual((job.imported, job.failed), (20, 1))
+        self.assertEqual(job.errors[0]['record'], 21)
+        report = Report.objects.get(title='Report 7')
+        self.assertEqual(report.summary, 'Summary, 7')
+        self.assertEqual(ReportSection.objects.get(report=report).data, 7)
+
+    def test_resume_continues_after_last_checkpoint(self):
+        job = self.make_job('\n'.join(self.contract_lines(6)))
+        calls = []
+
+        def interrupt(job):
+            calls.append(job.processed)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_import(job, workers=1, chunk_size=2, progress=interrupt)
+        # an interrupted job stays running at its last checkpoint, for --resume or --pending
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (ImportJob.STATUS_RUNNING, 4))
+
+        run_import(job, workers=1, chunk_size=2)
+        self.assertEqual(job.imported, 6)
+        self.assertEqual(Contract.objects.filter(title__startswith='Contract ').count(), 6)
+
+    def test_upload_endpoint_queues_job(self):
+        upload = SimpleUploadedFile('contracts.jsonl', '\n'.join(self.contract_lines(3)).encode())
+        response = self.client.post('/api/imports/', {'file': upload, 'document_type': 'contract'},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['import_format']), ('pending', 'ndjson'))
+
+        call_command('import_documents', pending=True, workers=1, stdout=io.StringIO())
+        response = self.client.get(f"/api/imports/{response.data['id']}/")
+        self.assertEqual((response.data['status'], response.data['imported']), ('done', 3))
+
+        self.client.force_authenticate(User.objects.create_user('other', password='password'))
+        self.assertEqual(self.client.get('/api/imports/').data['results'], [])
+
+    def test_pending_leaves_live_running_jobs_alone(self):
+        live = self.make_job('\n'.join(self.contract_lines(2)))
+        stale = self.make_job('\n'.join(self.contract_lines(2)))
+        ImportJob.objects.filter(pk__in=[live.pk, stale.pk]).update(status=ImportJob.STATUS_RUNNING)
+        ImportJob.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+
+        call_command('import_documents', pending=True, workers=1, stdout=io.StringIO())
+        live.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual((live.status, live.processed), (ImportJob.STATUS_RUNNING, 0))
+        self.assertEqual((stale.status, stale.imported), (ImportJob.STATUS_DONE, 2))
+        self.assertIsNone(claim_import_job())
+
+
+class ContractSectionTests(DocumentAPITestCase):
+    def create_sectioned_contract(self, count=3):
+        director = DocumentDirector(ContractBuilder())
+        contract = director.make_contract(
+            title='Contract', author=self.user, document_type=self.document_type, party_name='ACME',
+            start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1), value=Decimal('1000.00'),
+            terms_sections=[(f'Clause {i}', f'Text of clause {i}.') for i in range(count)],
+        )
+        contract.save()
+        return contract
+
+    def test_sections_follow_terms_text(self):
+        contract = self.create_sectioned_contract()
+        self.assertEqual(contract.terms_conditions.count('\n## Clause '), 3)
+        self.assertEqual(list(contract.terms_sections.values_list('title', flat=True)),
+                         ['Clause 0', 'Clause 1', 'Clause 2'])
+
+        contract.terms_conditions = 'Preamble\n## Scope\n\nEverything.'
+        contract.save()
+        self.assertEqual(list(contract.terms_sections.values_list('title', 'content')),
+                         [('', 'Preamble'), ('Scope', 'Everything.')])
+        self.assertEqual(Contract.join_terms(Contract.split_terms(contract.terms_conditions)),
+                         contract.terms_conditions)
+
+    def test_fetch_and_patch_single_section(self):
+        contract = self.create_sectioned_contract()
+        url = f'/api/contracts/{contract.pk}/sections/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.data[1], {'position': 1, 'title': 'Clause 1', 'size': len('Text of clause 1.')})
+        self.assertEqual(self.client.get(f'{url}1/').data['content'], 'Text of clause 1.')
+        self.assertEqual(self.client.get(f'{url}9/').status_code, 404)
+
+        response = self.client.patch(f'{url}1/', {'content': 'Amended.'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'position': 1, 'title': 'Clause 1', 'content': 'Amended.'})
+
+        contract.refresh_from_db()
+        self.assertIn('\n## Clause 1\n\nAmended.\n## Clause 2', contract.terms_conditions)
+        self.assertEqual(contract.terms_sections.count(), 3)
+        self.assertEqual(self.client.get(f'/api/contracts/{contract.pk}/').data['terms_conditions'],
+                         contract.terms_conditions)
+        revision = contract.revisions.order_by('-number').first()
+        self.assertEqual((revision.number, revision.changed_fields), (2, ['terms_conditions']))
+
+    def test_insert_section_shifts_later_ones(self):
+        contract = self.create_sectioned_contract()
+        url = f'/api/contracts/{contract.pk}/sections/'
+
+        response = self.client.post(url, {'title': 'Definitions', 'content': 'Terms used.', 'position': 1},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([section['title'] for section in self.client.get(url).data],
+                         ['Clause 0', 'Definitions', 'Clause 1', 'Clause 2'])
+        self.assertEqual(self.client.post(url, {'title': 'Annex'}, format='json').data['position'], 4)
+
+        contract.refresh_from_db()
+        self.assertEqual([title for title, _ in Contract.split_terms(contract.terms_conditions)],
+                         ['Clause 0', 'Definitions', 'Clause 1', 'Clause 2', 'Annex'])
+
+    def test_patched_sections_survive_a_full_save(self):
+        contract = self.create_sectioned_contract()
+        url = f'/api/contracts/{contract.pk}/sections/'
+        response = self.client.patch(f'{url}0/', {'content': 'aaa\n### Subclause\n\n##no space\n'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        contract.refresh_from_db()
+        before = list(contract.terms_sections.values_list('position', 'title', 'content'))
+        contract.save()
+        self.assertEqual(list(contract.terms_sections.values_list('position', 'title', 'content')), before)
+        self.assertEqual(Contract.join_terms(Contract.split_terms(contract.terms_conditions)),
+                         contract.terms_conditions)
+
+    def test_section_positions_are_unique(self):
+        contract = self.create_sectioned_contract()
+        for position in (0, 2, 5):
+            contract.insert_section(position, f'Inserted {position}', '')
+        self.assertEqual(list(contract.terms_sections.values_list('position', flat=True)), list(range(6)))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ContractSection.objects.create(contract=contract, position=1, title='Duplicate')
+
+    def test_section_validation(self):
+        contract = self.create_sectioned_contract()
+        url = f'/api/contracts/{contract.pk}/sections/'
+        self.assertEqual(self.client.post(url, {'content': 'No title'}, format='json').status_code, 400)
+        for content in ('a\n## Sneaky\n\nb', 'aaa\n## Fake\n', '## Leading'):
+            self.assertEqual(self.client.patch(f'{url}0/', {'content': content}, format='json').status_code, 400)
+        self.assertEqual(self.client.patch(f'{url}0/', {'title': 'Two\nlines'}, format='json').status_code, 400)
+
+        contract.terms_conditions = 'Preamble\n## Scope\n\nEverything.'
+        contract.save()
+        self.assertEqual(self.client.post(url, {'title': 'First', 'position': 0}, format='json').status_code, 400)
@@ -0,0 +1,153 @@
+import hashlib
+import mimetypes
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Blob, UploadSession
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# leading bytes of common formats, checked before falling back to the file extension
+MAGIC_NUMBERS = [
+    (b'%PDF', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+]
+
+
+class UploadError(Exception):
+    pass
+
+
+def session_path(session):
+    return Path(settings.UPLOAD_SESSIONS_ROOT) / f'{session.pk}.part'
+
+
+def blob_name(sha256, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'{sha256[:2]}/{sha256}{extension}'
+
+
+def detect_content_type(head, filename):
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if content_type == 'application/zip':
+                # docx/xlsx/... are zip containers, trust the extension for those
+                return mimetypes.guess_type(filename)[0] or content_type
+            return content_type
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def append_chunk(session, offset, stream, length, checksum=None):
+    if session.status != UploadSession.STATUS_OPEN:
+        raise UploadError('Upload is already complete')
+    if offset != session.received:
+        raise UploadError(f'Expected offset {session.received}')
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError(f'Chunks are limited to {settings.UPLOAD_CHUNK_MAX_SIZE} bytes')
+    if offset + length > session.size:
+        raise UploadError('Chunk runs past the declared size')
+
+    path = session_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # stream the body to disk, hashing the chunk as it is written
+    chunk_hash = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b' if path.exists() else 'wb') as output:
+        output.seek(offset)
+        while written < length:
+            data = stream.read(min(HASH_BLOCK_SIZE, length - written))
+            if not data:
+                break
+            output.write(data)
+            chunk_hash.update(data)
+            written += len(data)
+        output.truncate()
+
+    if written != length or (checksum and checksum.lower() != chunk_hash.hexdigest()):
+        # drop the partial chunk, the client resumes from the previous offset
+        with open(path, 'r+b') as output:
+            output.truncate(offset)
+        raise UploadError('Chunk is incomplete or does not match its checksum')
+
+    updated = UploadSession.objects.filter(pk=session.pk, received=offset).update(
+        received=offset + length, updated_at=timezone.now(),
+    )
+    if not updated:
+        raise UploadError('Concurrent upload to the same offset')
+    session.received = offset + length
+    return session
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        head = source.read(HASH_BLOCK_SIZE)
+        block = head
+        while block:
+            digest.update(block)
+            block = source.read(HASH_BLOCK_SIZE)
+    return digest.hexdigest(), head
+
+
+def complete_upload(session):
+    if session.status == UploadSession.STATUS_COMPLETE:
+        return session.blob
+    if session.received != session.size:
+        raise UploadError(f'Received {session.received} of {session.size} bytes')
+
+    path = session_path(session)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    sha256, head = hash_file(path)
+    if session.checksum and session.checksum.lower() != sha256:
+        raise UploadError('File does not match its checksum')
+
+    blob = Blob.objects.filter(sha256=sha256).first()
+    if blob is None:
+        with open(path, 'rb') as source:
+            blob = Blob(sha256=sha256, size=session.size,
+                        content_type=detect_content_type(head, session.filename))
+            blob.file.save(blob_name(sha256, session.filename), File(source), save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # another upload of the same content won the race
+            blob.file.delete(save=False)
+            blob = Blob.objects.get(sha256=sha256)
+
+    path.unlink(missing_ok=True)
+    session.status = UploadSession.STATUS_COMPLETE
+    session.blob = blob
+    session.save(update_fields=['status', 'blob', 'updated_at'])
+    return blob
+
+
+def collect_garbage(max_age=timedelta(days=1)):
+    cutoff = timezone.now() - max_age
+
+    stale_sessions = UploadSession.objects.filter(status=UploadSession.STATUS_OPEN, updated_at__lt=cutoff)
+    for session in stale_sessions:
+        session_path(session).unlink(missing_ok=True)
+    removed_sessions, _ = stale_sessions.delete()
+
+    removed_blobs = 0
+    for blob in Blob.objects.filter(ref_count=0, created_at__lt=cutoff):
+        with transaction.atomic():
+            if Blob.objects.filter(pk=blob.pk, ref_count=0).delete()[0]:
+                transaction.on_commit(lambda name=blob.file.name: blob.file.storage.delete(name))
+                removed_blobs += 1
+
+    return removed_sessions, removed_blobs
@@ -1,22 +1,297 @@
-from rest_framework import viewsets, status
+import hashlib
+import re
+from datetime import datetime, timezone
+
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.db import transaction
-
-from .models import DocumentType, Contract, Report, Note
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Q
+from django.db.models.functions import Length
+from django.core.exceptions import FieldDoesNotExist
+
+from .models import (
+    DocumentType, Contract, Report, ReportSection, Note, Attachment, Blob, UploadSession, Revision, ImportJob,
+)
 from .serializers import (
     DocumentTypeSerializer,
+    AttachmentSerializer,
     ContractSerializer,
     ReportSerializer,
     NoteSerializer,
+    UploadSessionSerializer,
+    BlobSerializer,
+    ImportJobSerializer,
+    ContractSectionSerializer,
 )
+from .uploads import UploadError, append_chunk, complete_upload
+from .downloads import serve_attachment
+from .cache import get_list_watermark
+from .analytics import DEFAULT_PERCENTILES, GROUP_FIELDS, report_analytics
+from .revisions import revision_filter, state_at, load_state, diff_states
 from .factories import (
     ContractCreator,
+    ReportCreator,
+    NoteCreator,
     ContractPackageFactory,
 )
 from .builders import ContractBuilder, ReportBuilder, DocumentDirector
 from notifications.singleton import NotificationService
+from docmanager.pagination import DocumentPagination
+
+
+def serializer_model_fields(serializer_class):
+    model = serializer_class.Meta.model
+    fields = []
+    for name in serializer_class.Meta.fields:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.concrete:
+            fields.append(name)
+    return fields
+
+
+class DocumentQueryPlanMixin:
+    # only() is limited to read actions: clone/update save the instance back
+    read_actions = ('list', 'retrieve', 'history', 'diff')
+
+    def get_attachments_prefetch(self):
+        related_field = self.queryset.model.attachments.field.name
+        attachments = Attachment.objects.only(*serializer_model_fields(AttachmentSerializer), related_field)
+        return Prefetch('attachments', queryset=attachments)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.read_actions:
+            # attachments are prefetched by the serializer, for representation cache misses only
+            return queryset.only(*serializer_model_fields(self.get_serializer_class()))
+        return queryset.prefetch_related(self.get_attachments_prefetch())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['prefetch'] = [self.get_attachments_prefetch()]
+        return context
+
+
+class DocumentConditionalGetMixin:
+    """
+    ETag/Last-Modified on list and retrieve. Conditional requests are checked
+    before the full queryset (prefetch, serializer) runs: a detail 304 costs one
+    small validator query, a list 304 none (the table watermark is cached).
+    """
+
+    def has_conditional_headers(self):
+        return 'HTTP_IF_NONE_MATCH' in self.request.META or 'HTTP_IF_MODIFIED_SINCE' in self.request.META
+
+    def document_etag(self, *parts):
+        # the renderer is part of the key: JSON and the browsable API differ for the same rows
+        key = '_'.join(str(part) for part in (*parts, self.request.accepted_renderer.format))
+        return f'W/"{hashlib.md5(key.encode()).hexdigest()}"'
+
+    def not_modified(self, etag, updated_at):
+        last_modified = int(updated_at.timestamp()) if updated_at else None
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            response['ETag'] = etag
+        return response
+
+    def set_validators(self, response, etag, updated_at):
+        response['ETag'] = etag
+        if updated_at:
+            response['Last-Modified'] = http_date(updated_at.timestamp())
+        return response
+
+    def detail_etag(self, pk, version, updated_at):
+        return self.document_etag(self.queryset.model._meta.label, pk, version, updated_at.timestamp())
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.has_conditional_headers():
+            lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+            try:
+                validators = (self.filter_queryset(self.get_queryset()).prefetch_related(None)
+                              .filter(**lookup).values_list('pk', 'version', 'updated_at').first())
+            except (TypeError, ValueError):
+                validators = None
+            if validators:
+                response = self.not_modified(self.detail_etag(*validators), validators[2])
+                if response is not None:
+                    return response
+
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        return self.set_validators(
+            response, self.detail_etag(instance.pk, instance.version, instance.updated_at), instance.updated_at,
+        )
+
+    def list(self, request, *args, **kwargs):
+        # saves, deletes and bulk inserts reset the table's watermark (documents/signals.py),
+        # so checking a list costs no query
+        watermark = get_list_watermark(self.queryset.model)
+        updated_at = datetime.fromtimestamp(watermark, tz=timezone.utc)
+        etag = self.document_etag(self.queryset.model._meta.label, watermark, request.get_full_path())
+        response = self.not_modified(etag, updated_at)
+        if response is not None:
+            return response
+        return self.set_validators(super().list(request, *args, **kwargs), etag, updated_at)
+
+
+class DocumentRevisionMixin:
+    history_page_size = 100
+
+    def perform_update(self, serializer):
+        # picked up by the post_save receiver that records the revision
+        serializer.instance._revision_author_id = self.request.user.pk
+        serializer.save()
+
+    def get_revision_number(self, value, latest):
+        if value in (None, ''):
+            return latest
+        number = int(value)
+        if not 1 <= number <= latest:
+            raise ValueError()
+        return number
+
+    def no_revisions(self):
+        return Response({'error': 'The document has no revisions'}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """Revisions of the document, newest first; ?revision=N returns that revision's fields."""
+        document = self.get_object()
+        revisions = Revision.objects.filter(**revision_filter(document)).order_by('-number')
+
+        if 'revision' in request.query_params:
+            latest = revisions.values_list('number', flat=True).first()
+            if latest is None:
+                return self.no_revisions()
+            try:
+                number = self.get_revision_number(request.query_params['revision'], latest)
+            except ValueError:
+                return Response({'error': f'revision must be between 1 and {latest}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                state = state_at(document, number)
+            except Revision.DoesNotExist as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'revision': number, 'fields': load_state(type(document), state)})
+
+        return Response([
+            {'revision': number, 'version': version, 'author': author_id, 'created_at': created_at,
+             'snapshot': is_snapshot, 'changed_fields': changed_fields}
+            for number, version, author_id, created_at, is_snapshot, changed_fields in revisions.values_list(
+                'number', 'version', 'author_id', 'created_at', 'is_snapshot', 'changed_fields',
+            )[:self.history_page_size]
+        ])
+
+    @action(detail=True, methods=['get'])
+    def diff(self, request, pk=None):
+        """?from=N&to=M (default: the latest revision against the one before it)."""
+        document = self.get_object()
+        latest = Revision.objects.filter(**revision_filter(document)).order_by('-number').values_list(
+            'number', flat=True).first()
+        if latest is None:
+            return self.no_revisions()
+        try:
+            to_number = self.get_revision_number(request.query_params.get('to'), latest)
+            from_number = self.get_revision_number(request.query_params.get('from'), max(to_number - 1, 1))
+        except ValueError:
+            return Response({'error': f'from and to must be revisions between 1 and {latest}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        model = type(document)
+        try:
+            changes = diff_states(model, state_at(document, from_number), state_at(document, to_number))
+        except Revision.DoesNotExist as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'from': from_number, 'to': to_number, 'changes': changes})
+
+
+class DocumentBulkCreateMixin:
+    creator_class = None
+    bulk_create_max_items = 10000
+
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        items = request.data.get('documents') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a list of documents'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.bulk_create_max_items:
+            return Response({'error': f'At most {self.bulk_create_max_items} documents per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        context = self.get_serializer_context()
+        context['related_cache'] = {}
+
+        results = [None] * len(items)
+        valid_indexes = []
+        valid_data = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {'index': index, 'errors': {'non_field_errors': ['Expected an object']}}
+                continue
+
+            serializer = self.get_serializer_class()(data={**item, 'author': request.user.pk}, context=context)
+            if serializer.is_valid():
+                valid_indexes.append(index)
+                valid_data.append(serializer.validated_data)
+            else:
+                results[index] = {'index': index, 'errors': serializer.errors}
+
+        # all or nothing: one invalid payload leaves the whole batch uncreated, so it can be fixed and resent
+        if len(valid_data) < len(items):
+            return Response({
+                'created': 0,
+                'failed': len(items) - len(valid_data),
+                'results': [result or {'index': index} for index, result in enumerate(results)],
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # factory method, batch mode
+        creator = self.creator_class()
+        documents = creator.register_documents(valid_data)
+
+        for index, document in zip(valid_indexes, documents):
+            results[index] = {'index': index, 'id': document.pk, 'unique_id': str(document.unique_id)}
+
+        return Response({'created': len(documents), 'failed': 0, 'results': results}, status=status.HTTP_201_CREATED)
+
+
+class DocumentCloneMixin:
+    clone_many_max_items = 1000
+
+    @action(detail=False, methods=['post'])
+    def clone_many(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response({'error': 'Expected a non-empty list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.clone_many_max_items:
+            return Response({'error': f'At most {self.clone_many_max_items} documents per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            originals = list(self.get_queryset().filter(pk__in=ids).order_by('pk'))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # prototype, batch mode
+        model = self.get_queryset().model
+        clones = model.clone_many(originals, with_attachments=bool(request.data.get('with_attachments')))
+
+        return Response({
+            'cloned': [
+                {'original': original.pk, 'id': cloned.pk, 'unique_id': str(cloned.unique_id)}
+                for original, cloned in zip(originals, clones)
+            ],
+            'missing': sorted({str(pk) for pk in ids} - {str(original.pk) for original in originals}),
+        }, status=status.HTTP_201_CREATED)
 
 
 class DocumentTypeViewSet(viewsets.ModelViewSet):
@@ -24,9 +299,12 @@ class DocumentTypeViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentTypeSerializer
 
 
-class ContractViewSet(viewsets.ModelViewSet):
+class ContractViewSet(DocumentQueryPlanMixin, DocumentConditionalGetMixin, DocumentRevisionMixin,
+                      DocumentBulkCreateMixin, DocumentCloneMixin, viewsets.ModelViewSet):
     queryset = Contract.objects.all()
     serializer_class = ContractSerializer
+    pagination_class = DocumentPagination
+    creator_class = ContractCreator
 
     @action(detail=True, methods=['post'])
     def clone(self, request, pk=None):
@@ -35,14 +313,16 @@ class ContractViewSet(viewsets.ModelViewSet):
         cloned = original.clone()
         if custom_field:
             cloned.custom_notes = custom_field
-        cloned.save()
 
-        notification_service = NotificationService()
-        notification_service.notify('document_cloned', {
-            'document': cloned,
-            'original': original,
-            'user': request.user
-        })
+        with transaction.atomic():
+            cloned.save()
+
+            notification_service = NotificationService()
+            notification_service.publish('document_cloned', {
+                'document': cloned,
+                'original': original,
+                'user': request.user
+            })
 
         return Response(self.get_serializer(cloned).data)
 
@@ -73,13 +353,14 @@ class ContractViewSet(viewsets.ModelViewSet):
                     value=request.data.get('contract_value')
                 )
 
-            contract.save()
+            with transaction.atomic():
+                contract.save()
 
-            notification_service = NotificationService()
-            notification_service.notify('document_created', {
-                'document': contract,
-                'user': request.user
-            })
+                notification_service = NotificationService()
+                notification_service.publish('document_created', {
+                    'document': contract,
+                    'user': request.user
+                })
 
             return Response(self.get_serializer(contract).data, status=status.HTTP_201_CREATED)
         except Exception as e:
@@ -133,6 +414,19 @@ class ContractViewSet(viewsets.ModelViewSet):
                 # Создание вложений, если они есть в запросе
                 attachments_data = request.data.get('attachments', [])
                 for attachment_data in attachments_data:
+                    if attachment_data.get('blob'):
+                        # content uploaded through /api/uploads/, only the uploader may attach it
+                        factory.create_attachment(
+                            document=contract,
+                            blob=Blob.objects.filter(
+                                pk=attachment_data['blob'],
+                                upload_sessions__user=request.user,
+                                upload_sessions__status=UploadSession.STATUS_COMPLETE,
+                            ).distinct().get(),
+                            filename=attachment_data.get('filename', ''),
+                            description=attachment_data.get('description')
+                        )
+                        continue
                     factory.create_attachment(
                         document=contract,
                         file=attachment_data.get('file'),
@@ -143,10 +437,122 @@ class ContractViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-
-class ReportViewSet(viewsets.ModelViewSet):
+    def get_section_contract(self, queryset):
+        contract = get_object_or_404(queryset, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, contract)
+        return contract
+
+    @action(detail=True, methods=['get', 'post'], serializer_class=ContractSectionSerializer)
+    def sections(self, request, pk=None):
+        """Outline of the terms (position, title, size); POST inserts a section at `position`, default the end."""
+        if request.method == 'GET':
+            contract = self.get_section_contract(Contract.objects.only('id'))
+            return Response(list(contract.terms_sections.order_by('position').values(
+                'position', 'title', size=Length('content'),
+            )))
+
+        contract = self.get_section_contract(Contract.objects.all())
+        serializer = ContractSectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            section = contract.insert_section(author_id=request.user.pk, **{
+                'position': None, 'content': '', **serializer.validated_data,
+            })
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return Response({'error': 'The sections were changed concurrently, retry'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(ContractSectionSerializer(section).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get', 'patch'], url_path=r'sections/(?P<position>\d+)',
+            serializer_class=ContractSectionSerializer)
+    def section(self, request, pk=None, position=None):
+        """A single terms section; PATCH changes its title and/or content."""
+        # reads never load the contract's terms text, writes save the contract back
+        contract = self.get_section_contract(
+            Contract.objects.only('id') if request.method == 'GET' else Contract.objects.all())
+        section = get_object_or_404(contract.terms_sections, position=int(position))
+        if request.method == 'GET':
+            return Response(ContractSectionSerializer(section).data)
+
+        serializer = ContractSectionSerializer(section, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        changes = {name: value for name, value in serializer.validated_data.items() if name in ('title', 'content')}
+        if changes:
+            contract.update_section(section, author_id=request.user.pk, **changes)
+        return Response(ContractSectionSerializer(section).data)
+
+
+class ReportViewSet(DocumentQueryPlanMixin, DocumentConditionalGetMixin, DocumentRevisionMixin,
+                    DocumentBulkCreateMixin, DocumentCloneMixin, viewsets.ModelViewSet):
     queryset = Report.objects.all()
     serializer_class = ReportSerializer
+    pagination_class = DocumentPagination
+    creator_class = ReportCreator
+
+    # ?section=<name> (repeatable), ?department=, ?report_date_after=, ?report_date_before=
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+
+        params = self.request.query_params
+        filters = {}
+        if params.get('department'):
+            filters['department'] = params['department']
+        for param, lookup in (('report_date_after', 'report_date__gte'), ('report_date_before', 'report_date__lte')):
+            if params.get(param):
+                try:
+                    value = parse_date(params[param])
+                except ValueError:
+                    value = None
+                if value is None:
+                    raise ValidationError({param: 'Expected a YYYY-MM-DD date'})
+                filters[lookup] = value
+
+        sections = params.getlist('section')
+        if sections:
+            # resolved on the indexed section table, report rows are only fetched by pk
+            matching = ReportSection.objects.filter(name__in=sections, **filters).values('report_id')
+            return queryset.filter(pk__in=matching)
+        return queryset.filter(**filters)
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        params = request.query_params
+        group_by = [field for field in params.get('group_by', ','.join(GROUP_FIELDS)).split(',') if field]
+        if any(field not in GROUP_FIELDS for field in group_by):
+            return Response({'error': f"group_by accepts {', '.join(GROUP_FIELDS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            percentiles = [float(value) for value in params.get('percentiles', '').split(',') if value]
+            if any(not 0 <= value <= 100 for value in percentiles):
+                raise ValueError()
+        except ValueError:
+            return Response({'error': 'percentiles must be numbers between 0 and 100'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        dates = {}
+        for param in ('report_date_after', 'report_date_before'):
+            if params.get(param):
+                try:
+                    dates[param] = parse_date(params[param])
+                except ValueError:
+                    dates[param] = None
+                if dates[param] is None:
+                    return Response({'error': f'{param} expects a YYYY-MM-DD date'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+        groups = report_analytics(
+            group_by=group_by,
+            percentiles=percentiles or DEFAULT_PERCENTILES,
+            departments=params.getlist('department'),
+            metrics=params.getlist('metric'),
+            date_after=dates.get('report_date_after'),
+            date_before=dates.get('report_date_before'),
+        )
+        return Response({'group_by': group_by, 'groups': groups})
 
     @action(detail=True, methods=['post'])
     def clone(self, request, pk=None):
@@ -184,9 +590,12 @@ class ReportViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class NoteViewSet(viewsets.ModelViewSet):
+class NoteViewSet(DocumentQueryPlanMixin, DocumentConditionalGetMixin, DocumentRevisionMixin,
+                  DocumentBulkCreateMixin, DocumentCloneMixin, viewsets.ModelViewSet):
     queryset = Note.objects.all()
     serializer_class = NoteSerializer
+    pagination_class = DocumentPagination
+    creator_class = NoteCreator
 
     @action(detail=True, methods=['post'])
     def clone(self, request, pk=None):
@@ -195,3 +604,96 @@ class NoteViewSet(viewsets.ModelViewSet):
         cloned = original.clone()
         cloned.save()
         return Response(self.get_serializer(cloned).data)
+
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable chunked uploads: create a session, PATCH chunks at the current
+    offset (Upload-Offset or Content-Range header), then POST complete.
+    GET on the session reports how many bytes were received, so an interrupted
+    client knows where to resume.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user).select_related('blob')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=['put', 'patch'])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            offset = request.headers.get('Upload-Offset')
+            if offset is None:
+                match = CONTENT_RANGE.fullmatch(request.headers.get('Content-Range', ''))
+                if not match:
+                    raise UploadError('Expected an Upload-Offset or Content-Range header')
+                offset = match.group(1)
+                if int(match.group(2)) - int(offset) + 1 != length:
+                    raise UploadError('Content-Range does not match the body length')
+            append_chunk(session, int(offset), request.stream, length,
+                         checksum=request.headers.get('Upload-Checksum'))
+        except ValueError:
+            return Response({'error': 'Invalid offset'}, status=status.HTTP_400_BAD_REQUEST)
+        except UploadError as e:
+            return Response({'error': str(e), 'received': session.received},
+                            status=status.HTTP_409_CONFLICT)
+
+        response = Response(self.get_serializer(session).data)
+        response['Upload-Offset'] = session.received
+        return response
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        try:
+            blob = complete_upload(session)
+        except UploadError as e:
+            return Response({'error': str(e), 'received': session.received},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(BlobSerializer(blob).data)
+
+
+class AttachmentViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = AttachmentSerializer
+    permission_classes = [IsAuthenticated]
+
+    # attachments are visible to the author of the document they belong to
+    def get_queryset(self):
+        user = self.request.user
+        return Attachment.objects.filter(Q(contract__author=user) | Q(report__author=user) | Q(note__author=user))
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        attachment = self.get_object()
+        try:
+            return serve_attachment(request, attachment)
+        except FileNotFoundError:
+            raise Http404('Attachment file no longer exists')
+
+
+class ImportJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Queues an NDJSON/CSV file for import; `manage.py import_documents --pending`
+    processes the queue. GET reports progress, throughput and the first errors.
+    """
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
@@ -0,0 +1,78 @@
+import os
+import zipfile
+from datetime import datetime
+
+ZIP_CHUNK_SIZE = 64 * 1024
+
+# formats that are already compressed gain nothing from deflate
+COMPRESSED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.mp4', '.mov', '.avi', '.mkv',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods',
+}
+
+
+class ZipStreamBuffer:
+    # write-only target for ZipFile; has tell() but no seek(), so zipfile writes
+    # data descriptors instead of seeking back to patch local headers
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def is_compressed(name):
+    return os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+# entries are (name, chunks, size or None); chunks may be a lazy iterable
+def stream_zip(entries):
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for name, chunks, size in entries:
+            info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED if is_compressed(name) else zipfile.ZIP_DEFLATED
+            info.file_size = size or 0
+
+            with archive.open(info, 'w', force_zip64=size is None) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def attachment_entry(attachment, folder=''):
+    filename = attachment.filename or os.path.basename(attachment.file.name)
+    name = f'{folder}attachments/{attachment.pk}-{filename}'
+    # size is recorded at upload time, older attachments still need a stat
+    size = attachment.size
+    if size is None:
+        try:
+            size = attachment.file.size
+        except (FileNotFoundError, OSError):
+            return None
+    return name, read_file_chunks(attachment.file), size
+
+
+def read_file_chunks(field_file):
+    with field_file.open('rb') as source:
+        yield from source.chunks(ZIP_CHUNK_SIZE)
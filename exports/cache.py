@@ -0,0 +1,50 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import parse_etags, parse_http_date_safe, quote_etag
+
+from .services import join_parts
+
+EXPORT_CACHE_ALIAS = 'exports'
+
+
+def export_cache_key(document_type, document, export_format):
+    return f"export_{document_type}_{document.pk}_{document.version}_{document.updated_at.timestamp()}_{export_format}"
+
+
+def export_etag(document_type, document, export_format):
+    key = export_cache_key(document_type, document, export_format)
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # weak comparison, gzip responses carry a weak ETag
+        etags = {tag.removeprefix('W/') for tag in parse_etags(if_none_match)}
+        return '*' in etags or etag.removeprefix('W/') in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified.timestamp()) <= if_modified_since
+
+
+def get_cached_export(document_type, document, export_format):
+    return caches[EXPORT_CACHE_ALIAS].get(export_cache_key(document_type, document, export_format))
+
+
+def cache_export_stream(document_type, document, export_format, parts):
+    # passes parts through, caching the joined result once fully sent if it stays small
+    buffer = []
+    size = 0
+    for part in parts:
+        if buffer is not None:
+            size += len(part)
+            if size > settings.EXPORT_CACHE_MAX_SIZE:
+                buffer = None
+            else:
+                buffer.append(part)
+        yield part
+
+    if buffer:
+        caches[EXPORT_CACHE_ALIAS].set(export_cache_key(document_type, document, export_format), join_parts(buffer))
@@ -0,0 +1,169 @@
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import ExportJob
+from .services import (
+    DOCUMENT_MODELS,
+    ExportDirector,
+    make_document_builder,
+    make_bulk_builder,
+    filter_documents,
+    prepare_export_queryset,
+    iter_by_pk,
+)
+
+PROGRESS_EVERY = 500
+EXPORT_JOB_CHUNK_SIZE = 500
+CLAIM_SCAN_LIMIT = 1000
+# seconds between heartbeats while a job writes its result, well under EXPORT_JOBS_STALE_AFTER
+HEARTBEAT_EVERY = 30
+
+
+class ExportJobCancelled(Exception):
+    pass
+
+
+def job_path(job):
+    return Path(settings.EXPORT_JOBS_ROOT) / job.result_file
+
+
+def validate_job(document_type, document_id, export_format, params):
+    if document_type not in DOCUMENT_MODELS:
+        raise ValueError('Invalid document type')
+    if document_id:
+        make_document_builder(document_type, export_format, params)
+    else:
+        make_bulk_builder(document_type, export_format, params)
+        filter_documents(DOCUMENT_MODELS[document_type].objects.none(), params)
+
+
+def render_job(job):
+    model = DOCUMENT_MODELS[job.document_type]
+    documents = model.objects.filter(author_id=job.user_id)
+    director = ExportDirector(None)
+
+    if job.document_id:
+        director.change_builder(make_document_builder(job.document_type, job.export_format, job.params))
+        document = prepare_export_queryset(documents).get(pk=job.document_id)
+        return 1, director.build_export_stream(document)
+
+    director.change_builder(make_bulk_builder(job.document_type, job.export_format, job.params))
+    documents = filter_documents(documents, job.params)
+    total = documents.count()
+    # the job writes progress between chunks, which an open read cursor would block on SQLite
+    documents = track_progress(job, iter_by_pk(prepare_export_queryset(documents), EXPORT_JOB_CHUNK_SIZE))
+    if job.export_format == 'zip':
+        return total, director.build_package(documents)
+    return total, director.build_exports(documents)
+
+
+def track_progress(job, documents):
+    processed = 0
+    for document in documents:
+        yield document
+        processed += 1
+        if processed % PROGRESS_EVERY == 0:
+            update_progress(job, processed)
+
+
+def update_progress(job, processed):
+    ExportJob.objects.filter(pk=job.pk).update(processed=processed, heartbeat_at=timezone.now())
+    if ExportJob.objects.filter(pk=job.pk, status=ExportJob.STATUS_CANCELLED).exists():
+        raise ExportJobCancelled()
+
+
+# runs in a worker process
+def run_export_job(job_id):
+    close_old_connections()
+    job = ExportJob.objects.get(pk=job_id)
+    job.result_file = f'{job.pk}.{job.export_format}'
+    path = job_path(job)
+    partial = path.with_suffix(path.suffix + '.part')
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        total, parts = render_job(job)
+        ExportJob.objects.filter(pk=job.pk).update(total=total)
+
+        with open(partial, 'wb') as output:
+            beat = time.monotonic()
+            for part in parts:
+                output.write(part.encode() if isinstance(part, str) else part)
+                # slow parts (large attachments, one big document) go between progress updates
+                if time.monotonic() - beat >= HEARTBEAT_EVERY:
+                    ExportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now())
+                    beat = time.monotonic()
+        os.replace(partial, path)
+
+        now = timezone.now()
+        updated = ExportJob.objects.filter(pk=job.pk, status=ExportJob.STATUS_RUNNING).update(
+            status=ExportJob.STATUS_DONE,
+            processed=total,
+            result_file=job.result_file,
+            result_size=path.stat().st_size,
+            finished_at=now,
+            expires_at=now + timedelta(seconds=settings.EXPORT_JOBS_TTL),
+        )
+        if not updated:
+            path.unlink(missing_ok=True)
+    except ExportJobCancelled:
+        partial.unlink(missing_ok=True)
+    except Exception as e:
+        partial.unlink(missing_ok=True)
+        # a job cancelled meanwhile stays cancelled
+        ExportJob.objects.filter(pk=job.pk, status=ExportJob.STATUS_RUNNING).update(
+            status=ExportJob.STATUS_FAILED, error=repr(e), finished_at=timezone.now(),
+        )
+        raise
+
+
+def claim_jobs(slots, per_user=None):
+    per_user = per_user or settings.EXPORT_JOBS_PER_USER
+    running = dict(
+        ExportJob.objects.filter(status=ExportJob.STATUS_RUNNING)
+        .values_list('user').annotate(count=Count('id')).order_by()
+    )
+
+    claimed = []
+    pending = ExportJob.objects.filter(status=ExportJob.STATUS_PENDING).order_by('created_at', 'id')
+    for job_id, user_id in list(pending.values_list('id', 'user_id')[:CLAIM_SCAN_LIMIT]):
+        if len(claimed) >= slots:
+            break
+        if running.get(user_id, 0) >= per_user:
+            continue
+        now = timezone.now()
+        started = ExportJob.objects.filter(pk=job_id, status=ExportJob.STATUS_PENDING).update(
+            status=ExportJob.STATUS_RUNNING, started_at=now, heartbeat_at=now,
+        )
+        if started:
+            running[user_id] = running.get(user_id, 0) + 1
+            claimed.append(job_id)
+    return claimed
+
+
+def collect_expired_jobs():
+    expired = ExportJob.objects.filter(status=ExportJob.STATUS_DONE, expires_at__lte=timezone.now())
+    count = 0
+    for job in expired.only('id', 'result_file'):
+        job_path(job).unlink(missing_ok=True)
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.STATUS_EXPIRED, result_file='')
+        count += 1
+    return count
+
+
+# running jobs whose worker stopped beating; live jobs of other worker processes are left alone
+def requeue_interrupted_jobs(stale_after=None):
+    stale_after = settings.EXPORT_JOBS_STALE_AFTER if stale_after is None else stale_after
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    return ExportJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status=ExportJob.STATUS_RUNNING,
+    ).update(status=ExportJob.STATUS_PENDING, processed=0, total=None, started_at=None, heartbeat_at=None)
+
@@ -0,0 +1,54 @@
+import datetime
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from documents.models import DocumentType, Contract
+from exports.pdf import LINES_PER_PAGE, LINE_WIDTH
+from exports.services import PDFExportBuilder, ExportDirector
+
+
+class Command(BaseCommand):
+    help = 'Measures PDF export throughput in pages per second. Runs inside a rolled back transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        clause = ('The parties agree that this clause is binding and enforceable. ' * 20).strip()
+        # roughly one page of wrapped text per paragraph group
+        paragraphs_per_page = max(LINES_PER_PAGE // (len(clause) // LINE_WIDTH + 2), 1)
+        terms = '\n\n'.join(clause for _ in range(options['pages'] * paragraphs_per_page))
+
+        with transaction.atomic():
+            contract = Contract.objects.create(
+                title='Benchmark contract',
+                author=User.objects.create(username=f'benchmark-{time.time_ns()}'),
+                document_type=DocumentType.objects.create(name='Benchmark'),
+                party_name='Benchmark', start_date=datetime.date.today(), end_date=datetime.date.today(),
+                contract_value=0, terms_conditions=terms,
+            )
+
+            director = ExportDirector(PDFExportBuilder())
+            for _ in range(options['repeat']):
+                tracemalloc.start()
+                started = time.perf_counter()
+                size = 0
+                chunks = 0
+                # PDFWriter yields the header, one chunk per page, then the trailer
+                for chunk in director.build_export_stream(contract):
+                    size += len(chunk)
+                    chunks += 1
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                pages = chunks - 2
+                self.stdout.write(f'{pages} pages, {size / 1024:.0f} KB in {elapsed:.2f}s: '
+                                  f'{pages / elapsed:.0f} pages/s, peak {peak / 1024:.0f} KB allocated')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,50 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from exports.jobs import claim_jobs, collect_expired_jobs, requeue_interrupted_jobs, run_export_job
+
+
+class Command(BaseCommand):
+    help = 'Renders queued export jobs on a process pool and removes expired results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.EXPORT_JOBS_WORKERS)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Run until the queue is empty, then exit')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        futures = {}
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            while True:
+                # every round, so jobs of a worker that died meanwhile are picked up too
+                requeued = requeue_interrupted_jobs()
+                if requeued:
+                    self.stdout.write(f'Requeued {requeued} interrupted jobs')
+
+                expired = collect_expired_jobs()
+                if expired:
+                    self.stdout.write(f'Removed {expired} expired exports')
+
+                for future in [future for future in futures if future.done()]:
+                    job_id = futures.pop(future)
+                    if future.exception():
+                        self.stderr.write(f'Export job {job_id} failed: {future.exception()!r}')
+                    else:
+                        self.stdout.write(f'Export job {job_id} finished')
+
+                job_ids = claim_jobs(workers - len(futures))
+                if job_ids:
+                    # forked workers must open their own database connections
+                    connections.close_all()
+                for job_id in job_ids:
+                    futures[pool.submit(run_export_job, job_id)] = job_id
+
+                if options['once'] and not futures and not job_ids:
+                    break
+                time.sleep(options['poll_interval'])
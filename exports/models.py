@@ -1,3 +1,52 @@
 from django.db import models
+from django.contrib.auth.models import User
 
-# Create your models here.
+
+class ExportJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_EXPIRED = 'expired'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    document_type = models.CharField(max_length=20)
+    # set for a single-document export, empty for a filtered bulk export
+    document_id = models.PositiveIntegerField(null=True, blank=True)
+    export_format = models.CharField(max_length=10)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=[
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+        (STATUS_EXPIRED, 'Expired'),
+    ], default=STATUS_PENDING)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    result_file = models.CharField(max_length=255, blank=True)
+    result_size = models.PositiveBigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # written by the worker while it runs the job, see exports/jobs.py
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='export_job_status_idx'),
+            models.Index(fields=['user', '-created_at'], name='export_job_user_idx'),
+        ]
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 1.0 if self.status == self.STATUS_DONE else 0.0
+        return min(self.processed / self.total, 1.0)
+
+    def __str__(self):
+        return f"{self.export_format} export of {self.document_type} #{self.pk} ({self.status})"
@@ -0,0 +1,140 @@
+# A4 in points, Helvetica 10pt
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 10
+LEADING = 12
+LINE_WIDTH = 95
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+CATALOG_ID = 1
+PAGES_ID = 2
+FONT_ID = 3
+
+
+def escape_text(line):
+    # standard fonts use WinAnsiEncoding (cp1252), anything outside it becomes '?'
+    text = line.encode('cp1252', 'replace')
+    return text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def iter_paragraphs(block):
+    # like str.split('\n') without copying the whole block up front
+    start = 0
+    while True:
+        end = block.find('\n', start)
+        if end == -1:
+            yield block[start:]
+            return
+        yield block[start:end]
+        start = end + 1
+
+
+# greedy word wrap, a lot cheaper than textwrap for page after page of clauses
+def wrap_paragraph(paragraph, width):
+    line = []
+    length = 0
+    for word in paragraph.split():
+        while len(word) > width:
+            if line:
+                yield ' '.join(line)
+                line = []
+                length = 0
+            yield word[:width]
+            word = word[width:]
+        if line and length + 1 + len(word) > width:
+            yield ' '.join(line)
+            line = []
+            length = 0
+        length += len(word) + (1 if line else 0)
+        line.append(word)
+    if line:
+        yield ' '.join(line)
+
+
+def wrap_lines(blocks, width=LINE_WIDTH):
+    for block in blocks:
+        for paragraph in iter_paragraphs(block):
+            wrapped = False
+            for line in wrap_paragraph(paragraph, width):
+                wrapped = True
+                yield line
+            if not wrapped:
+                yield ''
+
+
+def paginate(lines, lines_per_page=LINES_PER_PAGE):
+    page = []
+    for line in lines:
+        page.append(line)
+        if len(page) == lines_per_page:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+# writes a PDF one page at a time: only object offsets are kept,
+# the page tree and the cross-reference table are written at the end
+class PDFWriter:
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = FONT_ID + 1
+
+    def emit(self, data):
+        self.position += len(data)
+        return data
+
+    def write_object(self, object_id, body):
+        self.offsets[object_id] = self.position
+        return self.emit(b'%d 0 obj\n' % object_id + body + b'\nendobj\n')
+
+    def start(self):
+        return self.emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n') + self.write_object(
+            FONT_ID, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'
+        )
+
+    def add_page(self, lines):
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+
+        text = [b'BT', b'/F1 %d Tf' % FONT_SIZE, b'%d TL' % LEADING,
+                b'%d %d Td' % (MARGIN, PAGE_HEIGHT - MARGIN - FONT_SIZE)]
+        for line in lines:
+            text.append(b'(' + escape_text(line) + b") '")
+        text.append(b'ET')
+        stream = b'\n'.join(text)
+
+        return self.write_object(
+            content_id, b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream'
+        ) + self.write_object(
+            page_id,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+            b'/Resources << /Font << /F1 %d 0 R >> >> >>'
+            % (PAGES_ID, PAGE_WIDTH, PAGE_HEIGHT, content_id, FONT_ID)
+        )
+
+    def finish(self):
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        data = self.write_object(PAGES_ID, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids)))
+        data += self.write_object(CATALOG_ID, b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES_ID)
+
+        xref_position = self.position
+        size = self.next_id
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for object_id in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self.offsets[object_id])
+        xref.append(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                    % (size, CATALOG_ID, xref_position))
+        return data + self.emit(b''.join(xref))
+
+    def write(self, blocks):
+        yield self.start()
+        for page in paginate(wrap_lines(blocks)):
+            yield self.add_page(page)
+        if not self.page_ids:
+            yield self.add_page([])
+        yield self.finish()
@@ -0,0 +1,32 @@
+from rest_framework import serializers
+
+from .jobs import validate_job
+from .models import ExportJob
+from .services import DOCUMENT_MODELS
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+    params = serializers.DictField(required=False)
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'document_type', 'document_id', 'export_format', 'params', 'status', 'processed',
+                  'total', 'progress', 'result_size', 'error', 'created_at', 'started_at', 'finished_at',
+                  'expires_at']
+        read_only_fields = ['id', 'status', 'processed', 'total', 'progress', 'result_size', 'error',
+                            'created_at', 'started_at', 'finished_at', 'expires_at']
+
+    def validate(self, attrs):
+        try:
+            validate_job(attrs['document_type'], attrs.get('document_id'), attrs['export_format'],
+                         attrs.get('params', {}))
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+        document_id = attrs.get('document_id')
+        if document_id:
+            model = DOCUMENT_MODELS[attrs['document_type']]
+            if not model.objects.filter(pk=document_id, author=self.context['request'].user).exists():
+                raise serializers.ValidationError({'document_id': 'Document not found'})
+        return attrs
@@ -1,5 +1,19 @@
 from abc import ABC, abstractmethod
+import csv
 import json
+import zlib
+
+from django.utils.dateparse import parse_date
+
+from documents.models import Contract, Report, Note
+from .archive import attachment_entry, stream_zip
+from .pdf import PDFWriter
+
+DOCUMENT_MODELS = {
+    'contract': Contract,
+    'report': Report,
+    'note': Note,
+}
 
 
 class DocumentExportBuilder(ABC):
@@ -23,10 +37,14 @@ class DocumentExportBuilder(ABC):
     def get_result(self):
         pass
 
+    def iter_result(self):
+        yield self.get_result()
+
 
 class JSONExportBuilder(DocumentExportBuilder):
-    def __init__(self):
+    def __init__(self, pretty=False):
         self.result = {}
+        self.pretty = pretty
 
     def set_document(self, document):
         self.document = document
@@ -84,81 +102,129 @@ class JSONExportBuilder(DocumentExportBuilder):
 
         return self
 
+    def get_encoder(self):
+        if self.pretty:
+            return json.JSONEncoder(indent=4)
+        return json.JSONEncoder(separators=(',', ':'))
+
+    # encodes the sections piece by piece instead of materializing the whole string
+    def iter_result(self):
+        return self.get_encoder().iterencode(self.result)
+
     def get_result(self):
-        return json.dumps(self.result, indent=4)
+        return self.get_encoder().encode(self.result)
+
+
+class JSONLinesExportBuilder(JSONExportBuilder):
+    def get_result(self):
+        return json.dumps(self.result) + '\n'
+
+
+def truncate(value, length=100):
+    return value[:length] + '...' if len(value) > length else value
+
+
+# (key, header, value) per builder step; ?columns= selects keys
+CSV_METADATA_COLUMNS = [
+    ('id', 'ID', lambda d: d.id),
+    ('title', 'Title', lambda d: d.title),
+    ('unique_id', 'Unique ID', lambda d: d.unique_id),
+    ('created_at', 'Created At', lambda d: d.created_at.isoformat()),
+    ('updated_at', 'Updated At', lambda d: d.updated_at.isoformat()),
+    ('author', 'Author', lambda d: d.author.username),
+    ('status', 'Status', lambda d: d.status),
+    ('version', 'Version', lambda d: d.version),
+    ('document_type', 'Document Type', lambda d: d.document_type.name),
+]
+
+CSV_CONTENT_COLUMNS = {
+    'contract': [
+        ('party_name', 'Party Name', lambda d: d.party_name),
+        ('start_date', 'Start Date', lambda d: d.start_date.isoformat()),
+        ('end_date', 'End Date', lambda d: d.end_date.isoformat()),
+        ('contract_value', 'Value', lambda d: d.contract_value),
+        ('terms_conditions', 'Terms', lambda d: truncate(d.terms_conditions)),
+    ],
+    'report': [
+        ('report_date', 'Report Date', lambda d: d.report_date.isoformat()),
+        ('department', 'Department', lambda d: d.department),
+        ('summary', 'Summary', lambda d: truncate(d.summary)),
+    ],
+    'note': [
+        ('content', 'Content', lambda d: truncate(d.content)),
+        ('priority', 'Priority', lambda d: d.priority),
+    ],
+}
+
+CSV_ATTACHMENT_COLUMNS = [
+    # len() instead of count() so prefetched attachments don't cost a query
+    ('attachment_count', 'Attachment Count', lambda d: len(d.attachments.all())),
+]
+
+
+def get_csv_columns(document_type):
+    return CSV_METADATA_COLUMNS + CSV_CONTENT_COLUMNS[document_type] + CSV_ATTACHMENT_COLUMNS
+
+
+def validate_csv_columns(document_type, keys):
+    available = {key for key, _, _ in get_csv_columns(document_type)}
+    unknown = [key for key in keys if key not in available]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+
+class Echo:
+    # csv.writer target that hands each formatted line back instead of buffering it
+    def write(self, value):
+        return value
 
 
 class CSVExportBuilder(DocumentExportBuilder):
-    def __init__(self):
-        self.rows = []
+    def __init__(self, columns=None):
+        self.columns = set(columns) if columns else None
+        self.writer = csv.writer(Echo())
         self.headers = []
+        self.row = []
 
     def set_document(self, document):
         self.document = document
-        self.rows = []
         self.headers = []
+        self.row = []
         return self
 
-    def add_metadata(self):
-        self.headers.extend(['ID', 'Title', 'Unique ID', 'Created At', 'Updated At',
-                             'Author', 'Status', 'Version', 'Document Type'])
-
-        metadata_row = [
-            str(self.document.id),
-            self.document.title,
-            str(self.document.unique_id),
-            self.document.created_at.isoformat(),
-            self.document.updated_at.isoformat(),
-            self.document.author.username,
-            self.document.status,
-            str(self.document.version),
-            self.document.document_type.name
-        ]
+    def add_columns(self, columns):
+        for key, header, value in columns:
+            if self.columns is None or key in self.columns:
+                self.headers.append(header)
+                self.row.append(value(self.document))
 
-        self.rows.append(metadata_row)
+    def add_metadata(self):
+        self.add_columns(CSV_METADATA_COLUMNS)
         return self
 
     def add_content(self):
-        if hasattr(self.document, 'party_name'):  # Contract
-            self.headers.extend(['Party Name', 'Start Date', 'End Date', 'Value', 'Terms'])
-            self.rows[0].extend([
-                self.document.party_name,
-                self.document.start_date.isoformat(),
-                self.document.end_date.isoformat(),
-                str(self.document.contract_value),
-                self.document.terms_conditions[:100] + '...' if len(
-                    self.document.terms_conditions) > 100 else self.document.terms_conditions
-            ])
-        elif hasattr(self.document, 'report_date'):  # Report
-            self.headers.extend(['Report Date', 'Department', 'Summary'])
-            self.rows[0].extend([
-                self.document.report_date.isoformat(),
-                self.document.department,
-                self.document.summary[:100] + '...' if len(self.document.summary) > 100 else self.document.summary
-            ])
-        elif hasattr(self.document, 'content'):  # Note
-            self.headers.extend(['Content', 'Priority'])
-            self.rows[0].extend([
-                self.document.content[:100] + '...' if len(self.document.content) > 100 else self.document.content,
-                str(self.document.priority)
-            ])
-
+        self.add_columns(CSV_CONTENT_COLUMNS[self.document._meta.model_name])
         return self
 
     def add_attachments(self):
-        attachments = []
-        if hasattr(self.document, 'attachments'):
-            attachments = self.document.attachments.all()
-
-        self.headers.append('Attachment Count')
-        self.rows[0].append(str(attachments.count()))
+        self.add_columns(CSV_ATTACHMENT_COLUMNS)
         return self
 
     def get_result(self):
-        output = [','.join(self.headers)]
-        for row in self.rows:
-            output.append(','.join([f'"{cell}"' if ',' in cell else cell for cell in row]))
-        return '\n'.join(output)
+        return self.writer.writerow(self.headers) + self.writer.writerow(self.row)
+
+
+class CSVRowsExportBuilder(CSVExportBuilder):
+    def __init__(self, columns=None):
+        super().__init__(columns)
+        self.header_written = False
+
+    def get_result(self):
+        output = ''
+        if not self.header_written:
+            output = self.writer.writerow(self.headers)
+            self.header_written = True
+        return output + self.writer.writerow(self.row)
 
 
 class PDFExportBuilder(DocumentExportBuilder):
@@ -167,7 +233,7 @@ class PDFExportBuilder(DocumentExportBuilder):
 
     def set_document(self, document):
         self.document = document
-        self.content = ["PDF EXPORT SIMULATION"]
+        self.content = [self.document.title, ""]
         return self
 
     def add_metadata(self):
@@ -221,8 +287,60 @@ class PDFExportBuilder(DocumentExportBuilder):
 
         return self
 
+    # content holds references to the document's text, pages are laid out as they are written
+    def iter_result(self):
+        return PDFWriter().write(self.content)
+
     def get_result(self):
-        return "\n".join(self.content)
+        return b''.join(self.iter_result())
+
+
+class ZipPackageExportBuilder(DocumentExportBuilder):
+    # document.json plus the attachment files; bulk packages put each document in its own folder
+    def __init__(self, per_document_folders=False):
+        self.per_document_folders = per_document_folders
+        self.manifest = JSONExportBuilder(pretty=True)
+        self.attachments = []
+
+    def set_document(self, document):
+        self.document = document
+        self.manifest.set_document(document)
+        self.attachments = []
+        return self
+
+    def add_metadata(self):
+        self.manifest.add_metadata()
+        return self
+
+    def add_content(self):
+        self.manifest.add_content()
+        return self
+
+    def add_attachments(self):
+        self.manifest.add_attachments()
+        self.attachments = list(self.document.attachments.all())
+        return self
+
+    def get_folder(self):
+        if not self.per_document_folders:
+            return ''
+        return f'{self.document._meta.model_name}-{self.document.pk}/'
+
+    def get_entries(self):
+        folder = self.get_folder()
+        manifest = self.manifest.get_result().encode()
+        entries = [(f'{folder}document.json', [manifest], len(manifest))]
+        for attachment in self.attachments:
+            entry = attachment_entry(attachment, folder)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+
+    def iter_result(self):
+        return stream_zip(self.get_entries())
+
+    def get_result(self):
+        return b''.join(self.iter_result())
 
 
 class ExportDirector:
@@ -238,4 +356,154 @@ class ExportDirector:
             .add_metadata() \
             .add_content() \
             .add_attachments() \
-            .get_result()
\ No newline at end of file
+            .get_result()
+
+    def build_export_stream(self, document):
+        return self.builder \
+            .set_document(document) \
+            .add_metadata() \
+            .add_content() \
+            .add_attachments() \
+            .iter_result()
+
+    def build_exports(self, documents):
+        for document in documents:
+            yield self.build_export(document)
+
+    # one archive for all documents, for builders that package entries (zip)
+    def build_package(self, documents):
+        def entries():
+            for document in documents:
+                yield from self.builder \
+                    .set_document(document) \
+                    .add_metadata() \
+                    .add_content() \
+                    .add_attachments() \
+                    .get_entries()
+        return stream_zip(entries())
+
+
+DOCUMENT_EXPORT_FORMATS = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'pdf': 'application/pdf',
+    'zip': 'application/zip',
+}
+
+BULK_EXPORT_FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'zip': 'application/zip',
+}
+
+# already compressed or binary, served without gzip
+UNCOMPRESSED_FORMATS = {'zip'}
+
+
+def parse_columns(params):
+    columns = params.get('columns', '')
+    if not isinstance(columns, str):
+        raise ValueError('columns must be a comma separated string')
+    return [column for column in columns.split(',') if column]
+
+
+def make_document_builder(document_type, export_format, params):
+    if export_format == 'json':
+        return JSONExportBuilder(pretty=params.get('pretty') in ('1', 'true'))
+    if export_format == 'csv':
+        columns = parse_columns(params)
+        validate_csv_columns(document_type, columns)
+        return CSVExportBuilder(columns)
+    if export_format == 'pdf':
+        return PDFExportBuilder()
+    if export_format == 'zip':
+        return ZipPackageExportBuilder()
+    raise ValueError('Invalid export format')
+
+
+def make_bulk_builder(document_type, export_format, params):
+    if export_format == 'jsonl':
+        return JSONLinesExportBuilder()
+    if export_format == 'csv':
+        columns = parse_columns(params)
+        validate_csv_columns(document_type, columns)
+        return CSVRowsExportBuilder(columns)
+    if export_format == 'zip':
+        return ZipPackageExportBuilder(per_document_folders=True)
+    raise ValueError('Invalid export format')
+
+
+def filter_documents(documents, params):
+    document_status = params.get('status')
+    if document_status:
+        documents = documents.filter(status=document_status)
+
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    try:
+        if date_from:
+            documents = documents.filter(created_at__date__gte=parse_date(date_from))
+        if date_to:
+            documents = documents.filter(created_at__date__lte=parse_date(date_to))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid date range')
+
+    ids = params.get('ids')
+    if ids:
+        try:
+            ids = ids if isinstance(ids, list) else str(ids).split(',')
+            documents = documents.filter(id__in=[int(pk) for pk in ids if pk])
+        except (TypeError, ValueError):
+            raise ValueError('Invalid ids')
+
+    return documents
+
+
+# one query per chunk for documents and one for their attachments
+def prepare_export_queryset(documents):
+    return documents \
+        .select_related('author', 'document_type') \
+        .prefetch_related('attachments') \
+        .order_by('pk')
+
+
+# pages by primary key so no cursor stays open between chunks; ordered by pk
+def iter_by_pk(documents, chunk_size):
+    last_pk = 0
+    while True:
+        chunk = list(documents.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1].pk
+
+
+def join_parts(parts):
+    # exports are str, except PDF which is bytes
+    return parts[0][:0].join(parts)
+
+
+def iter_chunks(parts, chunk_size=64 * 1024):
+    # groups small per-document strings into fewer, larger writes to the response
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield join_parts(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield join_parts(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
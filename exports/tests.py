@@ -1,3 +1,283 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from documents.models import DocumentType, Contract, Attachment
+from .jobs import claim_jobs, collect_expired_jobs, job_path, requeue_interrupted_jobs, run_export_job
+from .models import ExportJob
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        caches['exports'].clear()
+        self.user = User.objects.create_user('author', password='password')
+        self.document_type = DocumentType.objects.create(name='General')
+        self.contract = Contract.objects.create(
+            title='Supply agreement', author=self.user, document_type=self.document_type,
+            party_name='ACME', start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1),
+            contract_value=1000, terms_conditions='Terms',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, export_format='json', **headers):
+        return self.client.get('/api/exports/', {
+            'document_type': 'contract',
+            'document_id': self.contract.pk,
+            'format': export_format,
+        }, headers=headers)
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+
+class ExportCacheTests(ExportTestCase):
+    def test_if_none_match_returns_304_without_rendering(self):
+        response = self.export()
+        self.assertEqual(response.status_code, 200)
+        self.content(response)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.export(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_export_is_served_until_document_changes(self):
+        first = self.content(self.export())
+        with self.assertNumQueries(1):
+            self.assertEqual(self.content(self.export()), first)
+
+        Attachment.objects.create(contract=self.contract, file='attachments/scan.pdf', description='Scan')
+        self.assertIn(b'Scan', self.content(self.export()))
+
+
+class CSVExportTests(ExportTestCase):
+    def test_cells_with_quotes_and_newlines_are_escaped(self):
+        self.contract.title = 'Supply "A", phase 1\nrevised'
+        self.contract.save()
+        response = self.export('csv')
+        rows = list(csv.reader(io.StringIO(self.content(response).decode())))
+        self.assertEqual(rows[1][1], self.contract.title)
+
+    def test_bulk_csv_streams_one_row_per_document_with_selected_columns(self):
+        Contract.objects.create(
+            title='Second', author=self.user, document_type=self.document_type, party_name='Globex',
+            start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1), contract_value=5,
+            terms_conditions='Terms',
+        )
+        response = self.client.get('/api/exports/bulk/', {
+            'document_type': 'contract', 'format': 'csv', 'columns': 'id,party_name',
+        })
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows, [['ID', 'Party Name'], [str(self.contract.pk), 'ACME'], [str(self.contract.pk + 1), 'Globex']])
+
+    def test_unknown_column_is_rejected(self):
+        response = self.client.get('/api/exports/bulk/', {'document_type': 'note', 'format': 'csv', 'columns': 'party_name'})
+        self.assertEqual(response.status_code, 400)
+
+
+class JSONExportTests(ExportTestCase):
+    def test_json_is_compact_unless_pretty_requested(self):
+        compact = self.content(self.export())
+        self.assertNotIn(b'\n', compact)
+
+        response = self.client.get('/api/exports/', {
+            'document_type': 'contract', 'document_id': self.contract.pk, 'pretty': '1',
+        })
+        self.assertEqual(json.loads(self.content(response)), json.loads(compact))
+
+    def test_gzip_is_negotiated(self):
+        response = self.export(accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        document = json.loads(gzip.decompress(self.content(response)))
+        self.assertEqual(document['metadata']['title'], self.contract.title)
+
+        response = self.export(accept_encoding='gzip', if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_q_values(self):
+        for accept_encoding, compressed in (
+            ('gzip;q=0', False), ('deflate, gzip; q=0.0', False), ('br, GZIP;q=0.5', True),
+            ('*', True), ('*;q=0', False), ('gzip;q=0, *', False), ('identity', False), ('gzipped', False),
+        ):
+            response = self.export(accept_encoding=accept_encoding)
+            self.assertEqual(response.get('Content-Encoding') == 'gzip', compressed, accept_encoding)
+
+    def test_bulk_jsonl_has_one_document_per_line_and_applies_filters(self):
+        created = [self.contract]
+        for title, document_status in (('Second', 'approved'), ('Third', 'approved'), ('Fourth', 'draft')):
+            created.append(Contract.objects.create(
+                title=title, author=self.user, document_type=self.document_type, party_name='Globex',
+                start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1), contract_value=5,
+                terms_conditions='Terms', status=document_status,
+            ))
+        # another author's contracts are never exported
+        other = User.objects.create_user('other', password='password')
+        Contract.objects.create(
+            title='Other', author=other, document_type=self.document_type, party_name='Initech',
+            start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1), contract_value=5,
+            terms_conditions='Terms',
+        )
+        Contract.objects.filter(pk=created[1].pk).update(created_at=timezone.now() - datetime.timedelta(days=30))
+
+        def export_titles(**params):
+            response = self.client.get('/api/exports/bulk/', {'document_type': 'contract', **params})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+            return [json.loads(line)['metadata']['title'] for line in lines]
+
+        self.assertEqual(export_titles(), ['Supply agreement', 'Second', 'Third', 'Fourth'])
+        self.assertEqual(export_titles(status='approved'), ['Second', 'Third'])
+        today = timezone.now().date().isoformat()
+        self.assertEqual(export_titles(status='approved', date_from=today), ['Third'])
+        self.assertEqual(export_titles(date_to=(timezone.now() - datetime.timedelta(days=1)).date().isoformat()),
+                         ['Second'])
+        self.assertEqual(export_titles(ids=f'{created[0].pk},{created[3].pk}'), ['Supply agreement', 'Fourth'])
+
+        for params in ({'date_from': 'soon'}, {'ids': '1,two'}):
+            response = self.client.get('/api/exports/bulk/', {'document_type': 'contract', **params})
+            self.assertEqual(response.status_code, 400)
+
+
+class PDFExportTests(ExportTestCase):
+    def test_pdf_has_valid_cross_reference_table(self):
+        self.contract.terms_conditions = '\n\n'.join(f'Clause {n} (binding).' for n in range(500))
+        self.contract.save()
+        data = self.content(self.export('pdf'))
+
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        self.assertTrue(data.endswith(b'%%EOF\n'))
+        xref_position = int(data.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        self.assertTrue(data[xref_position:].startswith(b'xref\n'))
+
+        xref = data[xref_position:].split(b'\n')
+        size = int(xref[1].split()[1])
+        for object_id, entry in enumerate(xref[3:size + 2], 1):
+            offset = int(entry.split()[0])
+            self.assertTrue(data[offset:].startswith(b'%d 0 obj' % object_id))
+        self.assertGreater(data.count(b'/Type /Page '), 10)
+
+
+class ExportJobTests(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.jobs_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.jobs_root.cleanup)
+        settings_override = override_settings(EXPORT_JOBS_ROOT=self.jobs_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def submit(self, **data):
+        return self.client.post('/api/exports/jobs/', {
+            'document_type': 'contract', 'export_format': 'jsonl', 'params': {}, **data,
+        }, format='json')
+
+    def test_submit_run_and_download(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['id']
+
+        self.assertEqual(claim_jobs(1), [job_id])
+        run_export_job(job_id)
+
+        job = self.client.get(f'/api/exports/jobs/{job_id}/').data
+        self.assertEqual((job['status'], job['progress']), ('done', 1.0))
+
+        response = self.client.get(f'/api/exports/jobs/{job_id}/download/')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(json.loads(lines[0])['metadata']['title'], self.contract.title)
+
+    def test_per_user_concurrency_limit(self):
+        job_ids = [self.submit().data['id'] for _ in range(3)]
+        self.assertEqual(claim_jobs(3, per_user=2), job_ids[:2])
+        self.assertEqual(claim_jobs(3, per_user=2), [])
+
+    def test_only_stale_running_jobs_are_requeued(self):
+        live, stale = self.submit().data['id'], self.submit().data['id']
+        self.assertEqual(claim_jobs(2), [live, stale])
+        ExportJob.objects.filter(pk=stale).update(heartbeat_at=timezone.now() - datetime.timedelta(hours=1))
+
+        self.assertEqual(requeue_interrupted_jobs(stale_after=600), 1)
+        self.assertEqual(ExportJob.objects.get(pk=live).status, ExportJob.STATUS_RUNNING)
+        self.assertEqual(ExportJob.objects.get(pk=stale).status, ExportJob.STATUS_PENDING)
+
+    def test_cancelled_job_is_not_run(self):
+        job_id = self.submit().data['id']
+        self.assertEqual(self.client.post(f'/api/exports/jobs/{job_id}/cancel/').status_code, 200)
+        self.assertEqual(claim_jobs(1), [])
+
+    def test_failure_after_cancel_keeps_the_job_cancelled(self):
+        job_id = self.submit().data['id']
+        self.assertEqual(claim_jobs(1), [job_id])
+        self.assertEqual(self.client.post(f'/api/exports/jobs/{job_id}/cancel/').status_code, 200)
+
+        with mock.patch('exports.jobs.render_job', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                run_export_job(job_id)
+        self.assertEqual(ExportJob.objects.get(pk=job_id).status, ExportJob.STATUS_CANCELLED)
+
+    def test_expired_results_are_removed(self):
+        job_id = self.submit(document_id=self.contract.pk, export_format='pdf').data['id']
+        claim_jobs(1)
+        run_export_job(job_id)
+        job = ExportJob.objects.get(pk=job_id)
+        self.assertTrue(job_path(job).exists())
+
+        ExportJob.objects.filter(pk=job_id).update(expires_at=timezone.now())
+        self.assertEqual(collect_expired_jobs(), 1)
+        self.assertFalse(job_path(job).exists())
+        self.assertEqual(self.client.get(f'/api/exports/jobs/{job_id}/download/').status_code, 409)
+
+    def test_invalid_job_is_rejected(self):
+        self.assertEqual(self.submit(export_format='pdf').status_code, 400)
+        self.assertEqual(self.submit(params={'columns': 'party_name', 'ids': 'x'}, export_format='csv').status_code, 400)
+        self.assertEqual(self.submit(params={'columns': ['id']}, export_format='csv').status_code, 400)
+        self.assertEqual(self.submit(params=['x'], export_format='csv').status_code, 400)
+
+
+class ZipExportTests(ExportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        Attachment.objects.create(contract=self.contract, file=SimpleUploadedFile('scan.pdf', b'%PDF' * 1000),
+                                  description='Scan')
+        Attachment.objects.create(contract=self.contract, file=SimpleUploadedFile('notes.txt', b'notes ' * 1000),
+                                  description='Notes')
+
+    def test_zip_package_contains_document_and_attachments(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.content(self.export('zip'))))
+        self.assertIsNone(archive.testzip())
+
+        entries = {info.filename.split('-', 1)[-1]: info for info in archive.infolist()}
+        self.assertEqual(set(entries), {'document.json', 'scan.pdf', 'notes.txt'})
+        self.assertEqual(entries['scan.pdf'].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(entries['notes.txt'].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(json.loads(archive.read('document.json'))['metadata']['title'], self.contract.title)
+
+    def test_bulk_zip_has_a_folder_per_document(self):
+        response = self.client.get('/api/exports/bulk/', {'document_type': 'contract', 'format': 'zip'},
+                                   headers={'accept_encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response)
+        archive = zipfile.ZipFile(io.BytesIO(self.content(response)))
+        folder = f'contract-{self.contract.pk}/'
+        self.assertIn(f'{folder}document.json', archive.namelist())
+        self.assertEqual(len(archive.namelist()), 3)
@@ -1,6 +1,11 @@
 from django.urls import path
-from .views import export_document
+from rest_framework.routers import SimpleRouter
+from .views import export_document, export_documents_bulk, ExportJobViewSet
+
+router = SimpleRouter()
+router.register(r'jobs', ExportJobViewSet, basename='export-job')
 
 urlpatterns = [
     path('', export_document, name='export_document'),
-]
\ No newline at end of file
+    path('bulk/', export_documents_bulk, name='export_documents_bulk'),
+] + router.urls
@@ -1,11 +1,78 @@
-from rest_framework.decorators import api_view, permission_classes
+import re
+
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header, http_date
+
+from .services import (
+    DOCUMENT_MODELS,
+    DOCUMENT_EXPORT_FORMATS,
+    BULK_EXPORT_FORMATS,
+    UNCOMPRESSED_FORMATS,
+    ExportDirector,
+    make_document_builder,
+    make_bulk_builder,
+    parse_columns,
+    filter_documents,
+    prepare_export_queryset,
+    iter_chunks,
+    gzip_chunks,
+)
+from .jobs import job_path
+from .models import ExportJob
+from .serializers import ExportJobSerializer
+from .cache import export_etag, is_not_modified, get_cached_export, cache_export_stream
+
+BULK_EXPORT_CHUNK_SIZE = 500
+
+# one coding of Accept-Encoding: name and optional q-value, e.g. 'gzip;q=0.5'
+CODING_RE = re.compile(r'^\s*([\w*.-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$', re.IGNORECASE)
+
+
+def attachment_header(name, file_extension):
+    # titles are free text: collapse newlines/tabs, quoting is left to Django
+    return content_disposition_header(True, f"{' '.join(name.split())}.{file_extension}")
+
+
+def accepts_gzip(request):
+    # gzip (or x-gzip) by name, otherwise through '*'; q=0 refuses it
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        match = CODING_RE.match(coding)
+        if match:
+            try:
+                qualities[match[1].lower()] = float(match[2]) if match[2] else 1.0
+            except ValueError:
+                continue
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def stream_response(parts, content_type, compress):
+    if compress:
+        response = StreamingHttpResponse(gzip_chunks(parts), content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(parts, content_type=content_type)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
 
-from documents.models import Contract, Report, Note
-from .services import JSONExportBuilder, CSVExportBuilder, PDFExportBuilder, ExportDirector
+def export_variant(export_format, params):
+    # the cache key and ETag depend on the output options too
+    if export_format == 'json' and params.get('pretty') in ('1', 'true'):
+        return 'json:pretty'
+    if export_format == 'csv' and params.get('columns'):
+        return f"csv:{','.join(parse_columns(params))}"
+    return export_format
 
 
 @api_view(['GET'])
@@ -15,42 +82,122 @@ def export_document(request):
     document_id = request.GET.get('document_id')
     export_format = request.GET.get('format', 'json')
 
-    document = None
-    if document_type == 'contract':
-        document = get_object_or_404(Contract, id=document_id)
-    elif document_type == 'report':
-        document = get_object_or_404(Report, id=document_id)
-    elif document_type == 'note':
-        document = get_object_or_404(Note, id=document_id)
-    else:
+    model = DOCUMENT_MODELS.get(document_type)
+    if model is None:
         return Response({'error': 'Invalid document type'}, status=400)
 
-    if document.author != request.user:
+    # only what the access check and cache validators need
+    document = get_object_or_404(model.objects.only('id', 'title', 'author', 'version', 'updated_at'), id=document_id)
+
+    if document.author_id != request.user.pk:
         return Response({'error': 'Access denied'}, status=403)
 
-    builder = None
-    content_type = ''
-    file_extension = ''
-
-    if export_format == 'json':
-        builder = JSONExportBuilder()
-        content_type = 'application/json'
-        file_extension = 'json'
-    elif export_format == 'csv':
-        builder = CSVExportBuilder()
-        content_type = 'text/csv'
-        file_extension = 'csv'
-    elif export_format == 'pdf':
-        builder = PDFExportBuilder()
-        content_type = 'application/pdf'
-        file_extension = 'pdf'
+    try:
+        builder = make_document_builder(document_type, export_format, request.GET)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    content_type = DOCUMENT_EXPORT_FORMATS[export_format]
+    cache_format = export_variant(export_format, request.GET)
+
+    compress = accepts_gzip(request) and export_format not in UNCOMPRESSED_FORMATS
+    etag = export_etag(document_type, document, cache_format)
+    if compress:
+        etag = f'W/{etag}'
+
+    if is_not_modified(request, etag, document.updated_at):
+        response = HttpResponseNotModified()
+        patch_vary_headers(response, ('Accept-Encoding',))
     else:
-        return Response({'error': 'Invalid export format'}, status=400)
+        result = get_cached_export(document_type, document, cache_format)
+        if result is None:
+            document = prepare_export_queryset(model.objects).get(pk=document.pk)
+
+            director = ExportDirector(builder)
+            parts = iter_chunks(director.build_export_stream(document))
+            parts = cache_export_stream(document_type, document, cache_format, parts)
+        else:
+            parts = [result]
+
+        response = stream_response(parts, content_type, compress)
+        response['Content-Disposition'] = attachment_header(document.title, export_format)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(document.updated_at.timestamp())
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_documents_bulk(request):
+    document_type = request.GET.get('document_type')
+    export_format = request.GET.get('format', 'jsonl')
+
+    model = DOCUMENT_MODELS.get(document_type)
+    if model is None:
+        return Response({'error': 'Invalid document type'}, status=400)
+
+    try:
+        builder = make_bulk_builder(document_type, export_format, request.GET)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    content_type = BULK_EXPORT_FORMATS[export_format]
+
+    try:
+        documents = filter_documents(model.objects.filter(author=request.user), request.GET)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    documents = prepare_export_queryset(documents).iterator(chunk_size=BULK_EXPORT_CHUNK_SIZE)
 
     director = ExportDirector(builder)
-    result = director.build_export(document)
+    if export_format == 'zip':
+        parts = director.build_package(documents)
+    else:
+        parts = iter_chunks(director.build_exports(documents))
+
+    compress = accepts_gzip(request) and export_format not in UNCOMPRESSED_FORMATS
+    response = stream_response(parts, content_type, compress)
+    response['Content-Disposition'] = attachment_header(f'{document_type}s', export_format)
+
+    return response
+
+
+class ExportJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        cancelled = ExportJob.objects.filter(
+            Q(status=ExportJob.STATUS_PENDING) | Q(status=ExportJob.STATUS_RUNNING), pk=job.pk,
+        ).update(status=ExportJob.STATUS_CANCELLED)
+        if not cancelled:
+            return Response({'error': f'Job is already {job.status}'}, status=400)
+        return Response({'status': 'export job cancelled'})
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ExportJob.STATUS_DONE:
+            return Response({'error': f'Job is {job.status}'}, status=409)
 
-    response = HttpResponse(result, content_type=content_type)
-    response['Content-Disposition'] = f'attachment; filename="{document.title}.{file_extension}"'
+        try:
+            result = open(job_path(job), 'rb')
+        except FileNotFoundError:
+            raise Http404('Export result no longer exists')
 
-    return response
\ No newline at end of file
+        filename = f"{job.document_type}{'' if job.document_id else 's'}.{job.export_format}"
+        return FileResponse(result, as_attachment=True, filename=filename,
+                            content_type=(DOCUMENT_EXPORT_FORMATS | BULK_EXPORT_FORMATS)[job.export_format])
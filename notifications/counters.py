@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Notification, UnreadCounter
+
+CACHE_TIMEOUT = 300
+
+
+def cache_key(user_id):
+    return f"notifications_unread_{user_id}"
+
+
+def invalidate(user_ids):
+    keys = [cache_key(user_id) for user_id in user_ids]
+    # after commit, so a concurrent read can't re-cache the old value
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def count_unread(user_id):
+    return Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+
+
+def load_unread_count(user_id):
+    count = UnreadCounter.objects.filter(user_id=user_id).values_list('count', flat=True).first()
+    if count is None:
+        counter, _ = UnreadCounter.objects.get_or_create(user_id=user_id, defaults={'count': count_unread(user_id)})
+        count = counter.count
+    return count
+
+
+def get_unread_count(user_id):
+    # single-flight on the tiered cache: one worker loads a cold counter, the rest wait for it
+    return cache.get_or_set(cache_key(user_id), lambda: load_unread_count(user_id), CACHE_TIMEOUT)
+
+
+def add_unread(deltas):
+    for user_id, delta in deltas.items():
+        if not delta:
+            continue
+        updated = UnreadCounter.objects.filter(user_id=user_id).update(count=F('count') + delta)
+        if not updated:
+            UnreadCounter.objects.get_or_create(user_id=user_id, defaults={'count': count_unread(user_id)})
+    invalidate(deltas)
+
+
+def notifications_created(notifications):
+    deltas = {}
+    for notification in notifications:
+        if not notification.is_read:
+            deltas[notification.recipient_id] = deltas.get(notification.recipient_id, 0) + 1
+    add_unread(deltas)
+
+
+def reset_unread(user_id):
+    updated = UnreadCounter.objects.filter(user_id=user_id).update(count=0)
+    if not updated:
+        UnreadCounter.objects.get_or_create(user_id=user_id)
+    invalidate([user_id])
+
+
+def reconcile_unread_counts():
+    actual = dict(
+        Notification.objects.filter(is_read=False)
+        .values_list('recipient')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    fixed = []
+    with transaction.atomic():
+        for counter in UnreadCounter.objects.select_for_update().iterator():
+            count = actual.pop(counter.user_id, 0)
+            if counter.count != count:
+                counter.count = count
+                fixed.append(counter)
+        UnreadCounter.objects.bulk_update(fixed, ['count'], batch_size=1000)
+        created = UnreadCounter.objects.bulk_create(
+            [UnreadCounter(user_id=user_id, count=count) for user_id, count in actual.items()],
+            batch_size=1000,
+        )
+        invalidate([counter.user_id for counter in fixed + created])
+
+    return len(fixed) + len(created)
@@ -0,0 +1,61 @@
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from notifications.models import Notification
+
+PAGE_SIZE = 50
+
+
+class Command(BaseCommand):
+    help = ('Times notification listing and marking read for growing per-user totals. '
+            'Runs inside a rolled back transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--unread', type=int, default=PAGE_SIZE,
+                            help='How many of the notifications are left unread')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def timed(self, func, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'total':>10} {'first page':>12} {'deep page':>12} {'unread count':>14} {'mark all read':>14}")
+
+        with transaction.atomic():
+            content_type = ContentType.objects.get_for_model(User)
+            for size in options['sizes']:
+                user = User.objects.create(username=f'benchmark-{size}-{time.time_ns()}')
+                Notification.objects.bulk_create([
+                    Notification(recipient=user, message='Benchmark', content_type=content_type, object_id=user.pk,
+                                 is_read=index >= options['unread'])
+                    for index in range(size)
+                ], batch_size=5000)
+
+                notifications = Notification.objects.filter(recipient=user).order_by('-created_at', '-id')
+                # the keyset cursor of a real row halfway down, as the paginator would build it;
+                # created_at is auto_now_add, so bulk_create can't backdate rows to aim at instead
+                created_at, pk = notifications.values_list('created_at', 'id')[size // 2]
+                deep = notifications.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+                if len(deep[:PAGE_SIZE]) != min(PAGE_SIZE, size - size // 2 - 1):
+                    raise CommandError('The deep page cursor did not select the expected rows')
+
+                first_page = self.timed(lambda: list(notifications[:PAGE_SIZE]), options['repeat'])
+                deep_page = self.timed(lambda: list(deep[:PAGE_SIZE]), options['repeat'])
+                unread_count = self.timed(
+                    lambda: Notification.objects.filter(recipient=user, is_read=False).count(), options['repeat'])
+                mark_all_read = self.timed(
+                    lambda: Notification.objects.filter(recipient=user, is_read=False).update(is_read=True), 1)
+
+                self.stdout.write(f'{size:>10} {first_page:>10.2f}ms {deep_page:>10.2f}ms '
+                                  f'{unread_count:>12.2f}ms {mark_all_read:>12.2f}ms')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.singleton import NotificationService
+
+
+class Command(BaseCommand):
+    help = 'Delivers pending notification outbox events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit')
+
+    def handle(self, *args, **options):
+        notification_service = NotificationService()
+
+        while True:
+            processed = notification_service.process_outbox(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Processed {processed} events')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
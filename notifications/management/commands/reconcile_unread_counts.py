@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notifications.counters import reconcile_unread_counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes unread notification counters from the notification table'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f'Fixed {fixed} unread counters'))
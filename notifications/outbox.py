@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, transaction
+from django.utils import timezone
+
+from .counters import notifications_created
+from .models import Notification, OutboxEvent
+
+MAX_ATTEMPTS = 5
+
+
+def serialize_event_data(data):
+    payload = {}
+    for key, value in data.items():
+        if isinstance(value, models.Model):
+            value = {
+                'content_type': ContentType.objects.get_for_model(value).pk,
+                'object_id': value.pk,
+                'repr': str(value),
+            }
+        elif getattr(value, 'is_anonymous', False):
+            value = None
+        payload[key] = value
+    return payload
+
+
+def publish_event(event_type, data):
+    return OutboxEvent.objects.create(event_type=event_type, payload=serialize_event_data(data))
+
+
+def document_created_notifications(payload):
+    document, user = payload['document'], payload.get('user')
+    if not user or not user.get('object_id'):
+        return []
+    return [Notification(
+        recipient_id=user['object_id'],
+        message=f'Document "{document["repr"]}" was created',
+        content_type_id=document['content_type'],
+        object_id=document['object_id'],
+    )]
+
+
+def document_cloned_notifications(payload):
+    document, original, user = payload['document'], payload['original'], payload.get('user')
+    if not user or not user.get('object_id'):
+        return []
+    return [Notification(
+        recipient_id=user['object_id'],
+        message=f'Document "{original["repr"]}" was cloned as "{document["repr"]}"',
+        content_type_id=document['content_type'],
+        object_id=document['object_id'],
+    )]
+
+
+NOTIFICATION_HANDLERS = {
+    'document_created': document_created_notifications,
+    'document_cloned': document_cloned_notifications,
+}
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(2 ** attempts, 300))
+
+
+def process_outbox_batch(service, batch_size=100):
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutboxEvent.STATUS_PENDING, available_at__lte=now)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        done_ids = []
+        notifications = []
+        for event in events:
+            try:
+                handler = NOTIFICATION_HANDLERS.get(event.event_type)
+                event_notifications = handler(event.payload) if handler else []
+                service.notify(event.event_type, event.payload)
+            except Exception as e:
+                event.attempts += 1
+                event.last_error = repr(e)
+                if event.attempts >= MAX_ATTEMPTS:
+                    event.status = OutboxEvent.STATUS_FAILED
+                    event.processed_at = now
+                else:
+                    event.available_at = now + retry_delay(event.attempts)
+                event.save(update_fields=['attempts', 'last_error', 'status', 'processed_at', 'available_at'])
+            else:
+                notifications.extend(event_notifications)
+                done_ids.append(event.pk)
+
+        Notification.objects.bulk_create(notifications)
+        notifications_created(notifications)
+        OutboxEvent.objects.filter(pk__in=done_ids).update(status=OutboxEvent.STATUS_DONE, processed_at=now)
+
+    return len(events)
@@ -1,3 +1,6 @@
+from .outbox import publish_event, process_outbox_batch
+
+
 class NotificationServiceMeta(type):
     _instances = {}
 
@@ -24,4 +27,12 @@ class NotificationService(metaclass=NotificationServiceMeta):
     def notify(self, event_type, data):
         if event_type in self.subscribers:
             for subscriber in self.subscribers[event_type]:
-                subscriber(data)
\ No newline at end of file
+                subscriber(data)
+
+    # durable variant of notify: the event is stored with the caller's transaction
+    # and delivered to subscribers by the process_outbox worker
+    def publish(self, event_type, data):
+        return publish_event(event_type, data)
+
+    def process_outbox(self, batch_size=100):
+        return process_outbox_batch(self, batch_size)
@@ -1,3 +1,101 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from documents.models import DocumentType, Contract
+from .counters import reconcile_unread_counts
+from .models import Notification, OutboxEvent
+from .singleton import NotificationService
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('author', password='password')
+        self.document_type = DocumentType.objects.create(name='General')
+        self.contract = Contract.objects.create(
+            title='Supply agreement', author=self.user, document_type=self.document_type,
+            party_name='ACME', start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1),
+            contract_value=1000, terms_conditions='Terms',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.notification_service = NotificationService()
+
+
+class OutboxTests(NotificationTestCase):
+    def test_clone_writes_outbox_event_instead_of_notifying(self):
+        self.client.post(f'/api/contracts/{self.contract.pk}/clone/')
+        self.assertEqual(OutboxEvent.objects.filter(event_type='document_cloned').count(), 1)
+        self.assertEqual(Notification.objects.count(), 0)
+
+        self.assertEqual(self.notification_service.process_outbox(), 1)
+        notification = Notification.objects.get()
+        self.assertEqual(notification.recipient, self.user)
+        self.assertEqual(OutboxEvent.objects.get().status, OutboxEvent.STATUS_DONE)
+
+    def test_failing_subscriber_is_retried(self):
+        def failing_subscriber(data):
+            raise RuntimeError('subscriber down')
+
+        self.notification_service.subscribe('document_cloned', failing_subscriber)
+        try:
+            self.client.post(f'/api/contracts/{self.contract.pk}/clone/')
+            self.notification_service.process_outbox()
+        finally:
+            self.notification_service.unsubscribe('document_cloned', failing_subscriber)
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.status, OutboxEvent.STATUS_PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('subscriber down', event.last_error)
+        self.assertEqual(Notification.objects.count(), 0)
+
+
+class UnreadCountTests(NotificationTestCase):
+    def create_notification(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(recipient=self.user, message='Hello', content_object=self.contract)
+
+    def get_unread_count(self):
+        return self.client.get('/api/notifications/unread_count/').data['unread_count']
+
+    def test_counter_follows_create_and_mark_read(self):
+        first = self.create_notification()
+        self.create_notification()
+        self.assertEqual(self.get_unread_count(), 2)
+
+        with self.assertNumQueries(0):
+            self.get_unread_count()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/notifications/{first.pk}/mark_as_read/')
+            self.client.post(f'/api/notifications/{first.pk}/mark_as_read/')
+        self.assertEqual(self.get_unread_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/notifications/mark_all_as_read/')
+        self.assertEqual(self.get_unread_count(), 0)
+
+    def test_reconcile_fixes_drift(self):
+        self.create_notification()
+        Notification.objects.update(is_read=True)
+        self.assertEqual(self.get_unread_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconcile_unread_counts(), 1)
+        self.assertEqual(self.get_unread_count(), 0)
+
+
+class NotificationQueryPlanTests(NotificationTestCase):
+    def test_list_is_served_by_recipient_index_without_sort(self):
+        plan = Notification.objects.filter(recipient=self.user).order_by('-created_at', '-id')[:50].explain()
+        self.assertIn('notification_recipient_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
 
-# Create your tests here.
+    def test_unread_lookup_uses_partial_index(self):
+        plan = Notification.objects.filter(recipient=self.user, is_read=False).explain()
+        self.assertIn('notification_unread_idx', plan)
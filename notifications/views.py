@@ -1,13 +1,19 @@
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.db import transaction
 
+from .counters import get_unread_count, add_unread, reset_unread
 from .models import Notification
 from .serializers import NotificationSerializer
+from docmanager.pagination import NotificationPagination
 
 
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination
 
     def get_queryset(self):
         return Notification.objects.filter(recipient=self.request.user).order_by('-created_at')
@@ -15,12 +21,18 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        with transaction.atomic():
+            if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+                add_unread({request.user.pk: -1})
         return Response({'status': 'notification marked as read'})
 
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
-        notifications = self.get_queryset()
-        notifications.update(is_read=True)
-        return Response({'status': 'all notifications marked as read'})
\ No newline at end of file
+        with transaction.atomic():
+            self.get_queryset().filter(is_read=False).update(is_read=True)
+            reset_unread(request.user.pk)
+        return Response({'status': 'all notifications marked as read'})
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread_count': get_unread_count(request.user.pk)})
\ No newline at end of file
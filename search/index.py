@@ -0,0 +1,152 @@
+from django.db import connection, transaction
+
+from documents.models import Contract, Report, Note
+
+INDEX_TABLE = 'search_document_index'
+
+# rowid = document id * ROWID_STRIDE + type code, so every document maps to one FTS row
+ROWID_STRIDE = 4
+
+INDEXED_TYPES = {
+    'contract': (1, Contract, 'terms_conditions'),
+    'report': (2, Report, 'summary'),
+    'note': (3, Note, 'content'),
+}
+
+TYPE_BY_MODEL = {model: document_type for document_type, (_, model, _) in INDEXED_TYPES.items()}
+TYPE_BY_CODE = {code: document_type for document_type, (code, _, _) in INDEXED_TYPES.items()}
+
+# bm25 column weights: title, body, custom_notes
+RANK_WEIGHTS = (10.0, 1.0, 2.0)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def make_rowid(document_type, document_id):
+    return document_id * ROWID_STRIDE + INDEXED_TYPES[document_type][0]
+
+
+def document_row(document_type, document_id, title, body, custom_notes):
+    return make_rowid(document_type, document_id), title, body, custom_notes or ''
+
+
+def index_documents(documents):
+    if not is_available():
+        return
+
+    rows = []
+    for document in documents:
+        document_type = TYPE_BY_MODEL[type(document)]
+        body_field = INDEXED_TYPES[document_type][2]
+        rows.append(document_row(document_type, document.pk, document.title,
+                                 getattr(document, body_field), document.custom_notes))
+
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {INDEX_TABLE} (rowid, title, body, custom_notes) VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+
+def remove_document(document):
+    if not is_available():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE} WHERE rowid = %s',
+                       [make_rowid(TYPE_BY_MODEL[type(document)], document.pk)])
+
+
+def rebuild_index(chunk_size=5000, progress=None):
+    if not is_available():
+        return 0
+
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE}')
+
+        for document_type, (_, model, body_field) in INDEXED_TYPES.items():
+            values = model.objects.order_by().values_list('id', 'title', body_field, 'custom_notes')
+            batch = []
+            for row in values.iterator(chunk_size=chunk_size):
+                batch.append(document_row(document_type, *row))
+                if len(batch) >= chunk_size:
+                    cursor.executemany(
+                        f'INSERT INTO {INDEX_TABLE} (rowid, title, body, custom_notes) VALUES (%s, %s, %s, %s)',
+                        batch,
+                    )
+                    total += len(batch)
+                    batch = []
+                    if progress:
+                        progress(total)
+            if batch:
+                cursor.executemany(
+                    f'INSERT INTO {INDEX_TABLE} (rowid, title, body, custom_notes) VALUES (%s, %s, %s, %s)',
+                    batch,
+                )
+                total += len(batch)
+
+        cursor.execute(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}) VALUES ('optimize')")
+
+    return total
+
+
+def build_match_expression(query):
+    # every term is quoted so user input can never be parsed as FTS5 syntax
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_documents(query, document_types=None, limit=20):
+    expression = build_match_expression(query)
+    if expression is None or not is_available():
+        return []
+
+    sql = (
+        f'SELECT rowid, bm25({INDEX_TABLE}, %s, %s, %s) AS rank, '
+        f"snippet({INDEX_TABLE}, -1, '[', ']', '...', 12) "
+        f'FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s'
+    )
+    params = [*RANK_WEIGHTS, expression]
+    if document_types:
+        codes = [INDEXED_TYPES[document_type][0] for document_type in document_types]
+        sql += f' AND rowid %% {ROWID_STRIDE} IN ({", ".join(["%s"] * len(codes))})'
+        params.extend(codes)
+    sql += ' ORDER BY rank LIMIT %s'
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        hits = cursor.fetchall()
+
+    ids_by_type = {}
+    for rowid, _, _ in hits:
+        ids_by_type.setdefault(TYPE_BY_CODE[rowid % ROWID_STRIDE], []).append(rowid // ROWID_STRIDE)
+
+    documents = {}
+    for document_type, ids in ids_by_type.items():
+        model = INDEXED_TYPES[document_type][1]
+        for document in model.objects.filter(id__in=ids).only('id', 'title', 'status', 'updated_at'):
+            documents[(document_type, document.id)] = document
+
+    results = []
+    for rowid, rank, snippet in hits:
+        document_type = TYPE_BY_CODE[rowid % ROWID_STRIDE]
+        document = documents.get((document_type, rowid // ROWID_STRIDE))
+        if document is None:
+            continue
+        results.append({
+            'type': document_type,
+            'id': document.id,
+            'title': document.title,
+            'status': document.status,
+            'updated_at': document.updated_at.isoformat(),
+            'rank': rank,
+            'snippet': snippet,
+        })
+    return results
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from search.index import is_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for contracts, reports and notes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not is_available():
+            self.stderr.write('Full-text search requires the SQLite backend')
+            return
+
+        started = time.monotonic()
+        total = rebuild_index(
+            chunk_size=options['chunk_size'],
+            progress=lambda count: self.stdout.write(f'Indexed {count} documents'),
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} documents in {elapsed:.1f}s'))
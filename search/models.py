@@ -0,0 +1,3 @@
+from django.db import models
+
+# Search rows live in the search_document_index FTS5 table, see index.py.
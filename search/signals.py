@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from documents.models import Contract, Report, Note
+from documents.signals import documents_bulk_created
+from .index import index_documents, remove_document
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_save, sender=Report)
+@receiver(post_save, sender=Note)
+def index_saved_document(sender, instance, **kwargs):
+    index_documents([instance])
+
+
+@receiver(post_delete, sender=Contract)
+@receiver(post_delete, sender=Report)
+@receiver(post_delete, sender=Note)
+def remove_deleted_document(sender, instance, **kwargs):
+    remove_document(instance)
+
+
+@receiver(documents_bulk_created)
+def index_bulk_created_documents(sender, documents, **kwargs):
+    if sender in (Contract, Report, Note):
+        index_documents(documents)
@@ -0,0 +1,47 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from documents.models import DocumentType, Contract, Note
+from .index import rebuild_index
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='password')
+        self.document_type = DocumentType.objects.create(name='General')
+        self.client = APIClient()
+        self.contract = Contract.objects.create(
+            title='Supply agreement', author=self.user, document_type=self.document_type,
+            party_name='ACME', start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2025, 1, 1),
+            contract_value=1000, terms_conditions='Delivery of turbines within 30 days.',
+        )
+        self.note = Note.objects.create(title='Call notes', author=self.user, document_type=self.document_type,
+                                        content='Discussed turbines delivery schedule.')
+
+    def test_search_returns_mixed_types(self):
+        response = self.client.get('/api/search/?q=turbines')
+        self.assertEqual({(r['type'], r['id']) for r in response.data['results']},
+                         {('contract', self.contract.pk), ('note', self.note.pk)})
+
+        response = self.client.get('/api/search/?q=turbines&types=note')
+        self.assertEqual([r['id'] for r in response.data['results']], [self.note.pk])
+
+    def test_search_limit(self):
+        self.assertEqual(len(self.client.get('/api/search/?q=turbines&limit=1').data['results']), 1)
+        for limit in ('-1', '0', 'all'):
+            response = self.client.get(f'/api/search/?q=turbines&limit={limit}')
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.contract.terms_conditions = 'Delivery of generators.'
+        self.contract.save()
+        self.note.delete()
+        self.assertEqual(self.client.get('/api/search/?q=turbines').data['results'], [])
+        self.assertEqual(len(self.client.get('/api/search/?q=generat').data['results']), 1)
+
+    def test_rebuild_index(self):
+        self.assertEqual(rebuild_index(chunk_size=1), 2)
+        self.assertEqual(len(self.client.get('/api/search/?q="turbines').data['results']), 2)
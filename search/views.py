@@ -0,0 +1,28 @@
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from .index import INDEXED_TYPES, search_documents
+
+MAX_SEARCH_RESULTS = 100
+
+
+@api_view(['GET'])
+def search(request):
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'Query parameter q is required'}, status=400)
+
+    document_types = [t for t in request.GET.get('types', '').split(',') if t]
+    if any(t not in INDEXED_TYPES for t in document_types):
+        return Response({'error': 'Invalid document type'}, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return Response({'error': 'Invalid limit'}, status=400)
+    # LIMIT -1 is no limit at all in SQLite
+    if limit < 1:
+        return Response({'error': 'Invalid limit'}, status=400)
+    limit = min(limit, MAX_SEARCH_RESULTS)
+
+    return Response({'results': search_documents(query, document_types, limit)})